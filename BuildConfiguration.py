@@ -12,10 +12,32 @@ class CompilationProperties:
 		"register": ["64", "32"],
 		"debug": ["True", "False"],
 		"optimization": ["0", "1", "2", "3", "size", "speed"],
+		"unity": ["False", "True"],
+		"unity_batch_size": ["2", "4", "8", "16", "32", "64"],
+		"time_trace": ["False", "True"],
+		"thin_archives": ["False", "True"],
+		"library_type": ["static", "shared"],
+		"linker": ["default", "lld", "mold"],
+		"link_threads": ["default", "1", "2", "4", "8", "16", "32"],
+		"split_dwarf": ["False", "True"],
+		"gdb_index": ["False", "True"],
+		"compress_debug_sections": ["False", "True"],
+		"lto": ["off", "thin", "full"],
+		"use_profile": ["False", "True"],
 		"additional_compile": [],
 		"additional_link": [],
 	}
 
+	optional = {
+		"unity", "unity_batch_size", "time_trace", "thin_archives", "library_type",
+		"linker", "link_threads", "split_dwarf", "gdb_index", "compress_debug_sections", "lto",
+		"use_profile",
+	}
+	"""Options that fall back to their default value when missing from the configuration file"""
+
+	derived = {"profile_generate", "profile_use"}
+	"""State set while building, never read from or saved to the configuration file"""
+
 	def __init__(self):
 		self.name = "Intel-64-Release"
 		"""Configuration ID"""
@@ -31,10 +53,38 @@ class CompilationProperties:
 		"""Produce debug information"""
 		self.optimization = "speed"
 		"""Desired optimization"""
+		self.unity = "False"
+		"""Compile sources of a project in batches merged into single translation units"""
+		self.unity_batch_size = "8"
+		"""Number of sources merged into one unity translation unit"""
+		self.time_trace = "False"
+		"""Write a clang time trace next to every object, read by the analyze-compile command"""
+		self.thin_archives = "False"
+		"""Archives reference their objects instead of holding copies of them"""
+		self.library_type = "static"
+		"""Build library projects as static archives or shared objects"""
+		self.linker = "default"
+		"""Linker used by the compiler driver, default leaves the choice to the compiler"""
+		self.link_threads = "default"
+		"""Threads the lld or mold linker may use"""
+		self.split_dwarf = "False"
+		"""Keep debug information in .dwo files next to the objects instead of linking it"""
+		self.gdb_index = "False"
+		"""Let the linker build a .gdb_index section so debuggers start faster"""
+		self.compress_debug_sections = "False"
+		"""Compress debug sections of objects and executables"""
+		self.lto = "off"
+		"""Link time optimization, objects and archives hold llvm bitcode optimized when linking"""
+		self.use_profile = "False"
+		"""Optimize with the profile the pgo command stored for this configuration"""
 		self.additional_compile = []
 		"""Additional object compilation flags"""
 		self.additional_link = []
 		"""Additional object linking flags"""
+		self.profile_generate = None
+		"""Directory instrumented executables write their raw profiles into, set by the pgo command"""
+		self.profile_use = None
+		"""Merged profile the sources are optimized with, set by the pgo command or the use_profile option"""
 
 	def load(self, absolute_directory_path, name):
 		# Load configuration file into json
@@ -46,7 +96,7 @@ class CompilationProperties:
 
 		# Validate required options
 		for option in self.interface.keys() - {"additional_compile", "additional_link"}:
-			value = config[option]
+			value = config.get(option, getattr(self, option) if option in self.optional else None)
 			if not value:
 				raise Errors.CBuildError(f"Missing required option '{option}' in '{config_path}'")
 			if value not in self.interface[option]:
@@ -67,6 +117,18 @@ class CompilationProperties:
 		self.register = config["register"]
 		self.debug = config["debug"]
 		self.optimization = config["optimization"]
+		self.unity = config.get("unity", self.unity)
+		self.unity_batch_size = config.get("unity_batch_size", self.unity_batch_size)
+		self.time_trace = config.get("time_trace", self.time_trace)
+		self.thin_archives = config.get("thin_archives", self.thin_archives)
+		self.library_type = config.get("library_type", self.library_type)
+		self.linker = config.get("linker", self.linker)
+		self.link_threads = config.get("link_threads", self.link_threads)
+		self.split_dwarf = config.get("split_dwarf", self.split_dwarf)
+		self.gdb_index = config.get("gdb_index", self.gdb_index)
+		self.compress_debug_sections = config.get("compress_debug_sections", self.compress_debug_sections)
+		self.lto = config.get("lto", self.lto)
+		self.use_profile = config.get("use_profile", self.use_profile)
 		self.additional_compile = config["additional_compile"]
 		self.additional_link = config["additional_link"]
 
@@ -87,4 +149,4 @@ class CompilationProperties:
 	def save(self, absolute_directory_path, config_name):
 		file_path = os.path.join(absolute_directory_path, config_name + ".json")
 		with open(file_path, 'w') as file:
-			json.dump(vars(self), file, indent=2)
+			json.dump({name: value for name, value in vars(self).items() if name not in self.derived}, file, indent=2)
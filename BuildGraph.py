@@ -0,0 +1,126 @@
+import os
+import concurrent.futures
+import Errors
+import Jobs
+import Trace
+
+
+class BuildGraph:
+	"""
+	Dependency graph of loaded projects with a single node per absolute project path.
+	Projects are built in topological order, independent ones concurrently.
+	"""
+
+	def __init__(self, root):
+		self.root = root
+		self.nodes = {}
+		"""Absolute project path -> project"""
+		self.edges = {}
+		"""Absolute project path -> absolute paths of its dependencies"""
+		self.order = []
+		"""Project paths in topological order, dependencies first"""
+		self.add(root, [])
+
+	def add(self, project, visiting: list) -> str:
+		path = os.path.abspath(project.project_path)
+		if path in visiting:
+			cycle = " -> ".join(visiting[visiting.index(path):] + [path])
+			raise Errors.CBuildError(f"Circular project dependency : {cycle}")
+		if path in self.nodes:
+			return path
+
+		self.nodes[path] = project
+		self.edges[path] = [self.add(dep, visiting + [path]) for dep in project.dependencies]
+		self.edges[path] = list(dict.fromkeys(self.edges[path]))
+
+		# share one instance of every project between its dependents
+		project.dependencies = [self.nodes[dep_path] for dep_path in self.edges[path]]
+		self.order.append(path)
+		return path
+
+	def mark_position_independent(self, config):
+		"""Shared libraries and every library linked into them compile position independent code"""
+		for path in self.order:
+			project = self.nodes[path]
+			project.position_independent = [name for name in project.position_independent if name != config.name]
+		for path in reversed(self.order):
+			project = self.nodes[path]
+			if project.shared_library(config) or project.position_independent_code(config):
+				for marked in [project] + project.dependencies:
+					if config.name not in marked.position_independent:
+						marked.position_independent.append(config.name)
+
+	def resolve_dependency_sets(self, config):
+		"""
+		Include directories, library directories and libraries of every project together with everything it depends on,
+		each listed once. Libraries follow the reversed topological order, so every library comes before the ones it depends on.
+		"""
+		closures = {}
+		for path in self.order:
+			project = self.nodes[path]
+			closures[path] = {path}.union(*(closures[dep] for dep in self.edges[path]))
+
+			includes = project.public_includes()
+			for dep in project.dependencies:
+				includes += dep.dependency_sets[config.name]["includes"]
+
+			libraries = []
+			library_directories = []
+			for linked_path in reversed(self.order):
+				if linked_path in closures[path]:
+					linked = self.nodes[linked_path]
+					libraries += [linked.linked_library(config)] + list(linked.additional_libraries)
+					library_directories += [linked.absolute_lib_dir(config)] + [linked.absolute_path(directory) for directory in linked.additional_lib_dirs]
+
+			# a library needed by several projects has to follow the last of them
+			libraries = list(reversed(dict.fromkeys(reversed(libraries))))
+			project.dependency_sets[config.name] = {
+				"includes": list(dict.fromkeys(includes)),
+				"library_directories": list(dict.fromkeys(library_directories)),
+				"libraries": libraries,
+			}
+
+	def build(self, config, forced=False) -> (bool, bool):
+		"""Builds every project once and returns api and library changes of the root project"""
+		return self.build_configurations([config], forced)[config.name]
+
+	def build_configurations(self, configs: list, forced=False) -> dict:
+		"""
+		Builds every project once per configuration, all targets share the worker threads and the job limit.
+		Returns configuration name -> api and library changes of the root project.
+		"""
+		for config in configs:
+			self.mark_position_independent(config)
+			self.resolve_dependency_sets(config)
+		targets = [(path, config) for config in configs for path in self.order]
+		# (project path, configuration name) -> api and library changes
+		results = {}
+		running = {}
+
+		def build_target(path, config):
+			dependencies = [(dep, config.name) for dep in self.edges[path]]
+			dep_api_changed = any(results[dep][0] for dep in dependencies)
+			dep_lib_changed = any(results[dep][1] for dep in dependencies)
+			with Trace.span(self.nodes[path].name, "project", path=path, config=config.name):
+				return self.nodes[path].compile_node(config, forced, dep_api_changed, dep_lib_changed)
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(Jobs.global_jobs, len(targets))), thread_name_prefix="cbuild-project") as pool:
+			try:
+				while len(results) < len(targets):
+					for path, config in targets:
+						key = (path, config.name)
+						if key in results or key in running.values():
+							continue
+						if all((dep, config.name) in results for dep in self.edges[path]):
+							running[pool.submit(build_target, path, config)] = key
+
+					finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+					for future in finished:
+						key = running.pop(future)
+						results[key] = future.result()
+			except BaseException:
+				pool.shutdown(wait=True, cancel_futures=True)
+				raise
+
+		root = os.path.abspath(self.root.project_path)
+		return {config.name: results[(root, config.name)] for config in configs}
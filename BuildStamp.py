@@ -0,0 +1,122 @@
+import os
+import json
+import Cache
+import BuildState
+
+cbuild_dir = os.path.dirname(os.path.abspath(__file__))
+source_extensions = {".cpp", ".hpp", ".h"}
+"""Files that become part of a project when they appear in one of its directories"""
+
+
+def stamp_path(project_path, config_name) -> str:
+	return os.path.join(Cache.global_cache_dir, "stamps", Cache.hash_strings([project_path, config_name]) + ".json")
+
+
+def config_files(project_path, config_name) -> list:
+	"""Every configuration file the build could be configured from, the project one takes precedence"""
+	return [os.path.join(os.path.dirname(project_path), config_name + ".json"), os.path.join(cbuild_dir, config_name + ".json"), profile_file(project_path, config_name)]
+
+
+def profile_file(project_path, config_name) -> str:
+	"""Merged profile the pgo command stores for a configuration, builds of the configuration with use_profile are optimized with it"""
+	return os.path.join(os.path.dirname(project_path), config_name + ".profdata")
+
+
+def environment_key() -> str:
+	return Cache.hash_strings([os.environ.get("PATH", "")])
+
+
+def cbuild_files() -> list:
+	return [os.path.join(cbuild_dir, name) for name in os.listdir(cbuild_dir) if name.endswith(".py") or name == "paths.json"]
+
+
+def is_current(project_path, config_name):
+	"""
+	Returns the stamp of the last successful build if none of the files it summarizes changed since, None otherwise.
+	Only files are checked, no project module is loaded.
+	"""
+	path = stamp_path(project_path, config_name)
+	try:
+		with open(path) as f:
+			stamp = json.load(f)
+	except (OSError, ValueError):
+		return None
+
+	if stamp.get("environment") != environment_key():
+		return None
+	for file, signature in stamp["files"].items():
+		if BuildState.signature(file) != signature:
+			return None
+	for directory, modification_time in stamp["directories"].items():
+		try:
+			if os.stat(directory).st_mtime_ns != modification_time:
+				return None
+		except OSError:
+			return None
+	return stamp
+
+
+def settled_modification_time(project, directory, scanned_time, project_files: set):
+	"""
+	Modification time a scanned directory is stamped with. Building adds output directories to the project directory,
+	a directory that changed in any other way since it was scanned keeps the time of the scan.
+	"""
+	try:
+		current_time = os.stat(directory).st_mtime_ns
+		if current_time == scanned_time:
+			return scanned_time
+		with os.scandir(directory) as entries:
+			entries = [(os.path.normpath(entry.path), entry.name, entry.is_dir(follow_symlinks=False)) for entry in entries]
+	except OSError:
+		return scanned_time
+
+	ignored_paths = project.output_paths()
+	for path, name, is_directory in entries:
+		if is_directory:
+			if path not in project.scanned_directories and path not in ignored_paths and not name.startswith(".") and name not in project.ignore_directories:
+				return scanned_time
+		elif os.path.splitext(name)[1] in source_extensions and path not in project_files:
+			return scanned_time
+	return current_time
+
+
+def save(project_path, config_name, projects, config, executable=None):
+	"""
+	Summarizes every input and output the finished build consulted together with the project files,
+	configuration files and scanned directories the project graph was loaded from.
+	"""
+	files = {}
+	directories = {}
+	for file in cbuild_files() + config_files(project_path, config_name):
+		files[file] = BuildState.signature(file)
+
+	for project in projects:
+		files[project.project_path] = BuildState.signature(project.project_path)
+		project_files = {project.absolute_path(file) for file in project.sources + project.headers}
+		for directory, scanned_time in project.scanned_directories.items():
+			directories[directory] = settled_modification_time(project, directory, scanned_time, project_files)
+
+		state = project.build_state(config)
+		for output in state.consulted:
+			record = state.records.get(output)
+			if record is None or record["result"] != "success":
+				# a step that did not succeed never belongs to an up to date build
+				return
+			if not output.startswith(":"):
+				files[output] = record["signature"]
+			# only the signature part, content digests are compared by the build itself
+			files.update({path: recorded[:2] if recorded else recorded for path, recorded in record["inputs"].items()})
+
+	stamp = {"environment": environment_key(), "executable": executable, "files": files, "directories": directories}
+	path = stamp_path(project_path, config_name)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path + ".tmp", "w") as f:
+		json.dump(stamp, f)
+	os.replace(path + ".tmp", path)
+
+
+def remove(project_path, config_name):
+	try:
+		os.remove(stamp_path(project_path, config_name))
+	except OSError:
+		pass
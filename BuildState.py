@@ -0,0 +1,179 @@
+import os
+import json
+import threading
+import Errors
+import Cache
+
+global_states = {}
+"""State file path -> loaded state, shared by every build of the process"""
+global_states_lock = threading.Lock()
+
+
+def signature(path):
+	"""Cheap signature of a file, None if it does not exist or names a virtual step starting with ':'"""
+	if path.startswith(":"):
+		return None
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return [stat.st_mtime_ns, stat.st_size]
+
+
+def content_signature(path):
+	"""Signature extended by the content digest, an input recorded with it survives being rewritten with the same content"""
+	current = signature(path)
+	return current + [Cache.file_digest(path)] if current else current
+
+
+class BuildState:
+	"""
+	Records of the finished build steps of one project configuration.
+	Every record holds the signatures of the inputs and the output of a step together with the command that produced it.
+	Records are appended to the state file as soon as a step finishes, so an interrupted build keeps its finished work.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.records = {}
+		self.journal_length = 0
+		self.consulted = set()
+		"""Outputs checked or recorded by this process"""
+		self.lock = threading.Lock()
+		self.load()
+
+	def load(self):
+		if not os.path.exists(self.path):
+			return
+		with open(self.path) as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					# line cut short by an interrupted build
+					continue
+				self.records[record["output"]] = record
+				self.journal_length += 1
+
+	def outdated(self, output, inputs=None, command=None, signatures=None) -> bool:
+		"""
+		Checks the output against its record. The inputs and command are the ones the step would use now,
+		None checks against the recorded ones only. The signatures dict caches file signatures between calls.
+		"""
+		self.consulted.add(output)
+		record = self.records.get(output)
+		if record is None or record["result"] != "success":
+			return True
+		if signature(output) != record["signature"]:
+			return True
+		if command is not None and Cache.hash_strings(command) != record["command"]:
+			return True
+		if inputs is not None and sorted(inputs) != sorted(record["inputs"]):
+			return True
+
+		refreshed = {}
+		for path, recorded_signature in record["inputs"].items():
+			if signatures is None:
+				current_signature = signature(path)
+			else:
+				if path not in signatures:
+					signatures[path] = signature(path)
+				current_signature = signatures[path]
+			if not self.unchanged(path, recorded_signature, current_signature, refreshed):
+				return True
+
+		if refreshed:
+			self.refresh(output, refreshed)
+		return False
+
+	@staticmethod
+	def unchanged(path, recorded_signature, current_signature, refreshed: dict) -> bool:
+		"""Compares an input with its record, inputs rewritten with the content they were recorded with are added to refreshed"""
+		if current_signature is None or recorded_signature is None:
+			return current_signature == recorded_signature
+		if current_signature == recorded_signature[:2]:
+			return True
+		if len(recorded_signature) > 2 and Cache.file_digest(path) == recorded_signature[2]:
+			refreshed[path] = current_signature + recorded_signature[2:]
+			return True
+		return False
+
+	def changed_inputs(self, output, inputs, command_of) -> (list, list):
+		"""
+		Inputs that are new or changed since the output was produced and recorded inputs that are no longer used.
+		None if there is no successful record of the output to compare with, or the output was produced by a different
+		command than command_of returns for the recorded inputs.
+		"""
+		record = self.records.get(output)
+		if record is None or record["result"] != "success" or signature(output) != record["signature"]:
+			return None
+		if Cache.hash_strings(command_of(list(record["inputs"]))) != record["command"]:
+			return None
+		refreshed = {}
+		changed = [path for path in inputs if path not in record["inputs"] or not self.unchanged(path, record["inputs"][path], signature(path), refreshed)]
+		removed = [path for path in record["inputs"] if path not in inputs]
+		return changed, removed
+
+	def refresh(self, output, refreshed: dict):
+		"""Records the new signatures of inputs that were rewritten without changing, so their content is not compared again"""
+		with self.lock:
+			record = dict(self.records[output])
+			record["inputs"] = {**record["inputs"], **refreshed}
+			self.records[output] = record
+			with open(self.path, "a") as f:
+				f.write(json.dumps(record) + "\n")
+			self.journal_length += 1
+
+	def record(self, output, inputs, command, result="success", content_inputs=False, duration=None):
+		"""
+		Content inputs are compared by their digest when their signature changes, for outputs that are expensive to redo.
+		The duration of the step is kept to compare the next run of the step with.
+		"""
+		input_signature = content_signature if content_inputs else signature
+		record = {
+			"output": output,
+			"signature": signature(output),
+			"inputs": {path: input_signature(path) for path in inputs},
+			"command": Cache.hash_strings(command) if command is not None else None,
+			"result": result,
+		}
+		if duration is not None:
+			record["duration"] = duration
+		with self.lock:
+			self.records[output] = record
+			self.consulted.add(output)
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			with open(self.path, "a") as f:
+				f.write(json.dumps(record) + "\n")
+			self.journal_length += 1
+
+	def forget_if_removed(self):
+		"""Drops the records once their state file was deleted, like by clearing the project"""
+		with self.lock:
+			if self.journal_length and not os.path.exists(self.path):
+				self.records = {}
+				self.journal_length = 0
+
+	def compact(self):
+		"""Rewrites the state file without superseded records"""
+		with self.lock:
+			if self.journal_length <= 2 * len(self.records) + 64:
+				return
+			try:
+				with open(self.path + ".tmp", "w") as f:
+					for record in self.records.values():
+						f.write(json.dumps(record) + "\n")
+				os.replace(self.path + ".tmp", self.path)
+				self.journal_length = len(self.records)
+			except OSError as error:
+				Errors.warn(f"Unable to compact build state '{self.path}' : {error}")
+
+
+def get(path) -> BuildState:
+	"""One state per file for the whole process, so every caller records into the same one"""
+	with global_states_lock:
+		if path not in global_states:
+			global_states[path] = BuildState(path)
+		state = global_states[path]
+	state.forget_if_removed()
+	return state
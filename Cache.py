@@ -0,0 +1,159 @@
+import os
+import shutil
+import hashlib
+import threading
+import Errors
+
+global_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "cbuild")
+"""Root directory of every cache cbuild keeps between invocations"""
+
+
+def hash_strings(strings) -> str:
+	digest = hashlib.sha256()
+	for string in strings:
+		digest.update(string.encode() if isinstance(string, str) else string)
+		digest.update(b"\0")
+	return digest.hexdigest()
+
+
+file_digests = {}
+"""(path, mtime, size) -> content digest of files hashed during this process"""
+file_digests_lock = threading.Lock()
+
+
+def file_digest(path) -> str:
+	stat = os.stat(path)
+	identity = (path, stat.st_mtime_ns, stat.st_size)
+	with file_digests_lock:
+		if identity in file_digests:
+			return file_digests[identity]
+
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			digest.update(chunk)
+
+	with file_digests_lock:
+		file_digests[identity] = digest.hexdigest()
+	return file_digests[identity]
+
+
+class ObjectCache:
+	"""
+	Content addressed store of compiled objects shared by every project and configuration.
+	Entries are looked up by a key computed from the preprocessed source and the compilation flags,
+	least recently used entries are evicted once the cache grows over its size limit.
+	"""
+
+	def __init__(self, size_limit_mb: int = 5120):
+		self.size_limit_mb = size_limit_mb
+		"""Cache size limit in megabytes, 0 disables the cache"""
+		self.hits = 0
+		self.misses = 0
+		self.stored_size = 0
+		"""Bytes stored during this build, added to the recorded cache size instead of measuring the cache again"""
+		self.lock = threading.Lock()
+
+	def enabled(self) -> bool:
+		return self.size_limit_mb > 0
+
+	def directory(self) -> str:
+		return os.path.join(global_cache_dir, "objects")
+
+	def entry_path(self, key) -> str:
+		return os.path.join(self.directory(), key[:2], key + ".o")
+
+	def size_path(self) -> str:
+		return os.path.join(self.directory(), "size")
+
+	def recorded_size(self):
+		"""Cache size written by the last build, None if unknown"""
+		try:
+			with open(self.size_path()) as f:
+				return int(f.read())
+		except (OSError, ValueError):
+			return None
+
+	def record_size(self, size: int):
+		temp_path = f"{self.size_path()}.{os.getpid()}.tmp"
+		try:
+			os.makedirs(self.directory(), exist_ok=True)
+			with open(temp_path, "w") as f:
+				f.write(str(size))
+			os.replace(temp_path, self.size_path())
+		except OSError as error:
+			Errors.warn(f"Unable to record the object cache size : {error}")
+
+	def fetch(self, key, output) -> bool:
+		entry = self.entry_path(key)
+		try:
+			shutil.copyfile(entry, output)
+			# mark entry as recently used
+			os.utime(entry)
+		except OSError:
+			with self.lock:
+				self.misses += 1
+			return False
+
+		with self.lock:
+			self.hits += 1
+		return True
+
+	def store(self, key, output):
+		entry = self.entry_path(key)
+		os.makedirs(os.path.dirname(entry), exist_ok=True)
+		temp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+		try:
+			shutil.copyfile(output, temp_entry)
+			os.replace(temp_entry, entry)
+			with self.lock:
+				self.stored_size += os.path.getsize(entry)
+		except OSError as error:
+			Errors.warn(f"Unable to store '{output}' in object cache : {error}")
+			if os.path.exists(temp_entry):
+				os.remove(temp_entry)
+
+	def evict(self) -> int:
+		"""Removes least recently used entries until the cache fits its size limit and returns the remaining size"""
+		entries = []
+		total_size = 0
+		if os.path.exists(self.directory()):
+			for bucket in os.scandir(self.directory()):
+				if not bucket.is_dir():
+					continue
+				for entry in os.scandir(bucket.path):
+					stat = entry.stat()
+					entries.append((stat.st_mtime, stat.st_size, entry.path))
+					total_size += stat.st_size
+
+		limit = self.size_limit_mb * 1024 * 1024
+		for _, size, path in sorted(entries):
+			if total_size <= limit:
+				break
+			try:
+				os.remove(path)
+				total_size -= size
+			except OSError:
+				pass
+		return total_size
+
+	def finish(self):
+		"""Reports the statistics of the finished build and trims the cache once it may have outgrown its size limit"""
+		if not self.enabled() or not (self.hits + self.misses):
+			return
+		# replaced entries are counted twice, which only makes the next measurement come earlier
+		size = self.recorded_size()
+		if size is None or size + self.stored_size > self.size_limit_mb * 1024 * 1024:
+			size = self.evict()
+		else:
+			size += self.stored_size
+		self.record_size(size)
+		self.stored_size = 0
+		lookups = self.hits + self.misses
+		Errors.log(f"Object cache : {self.hits} hits, {self.misses} misses ({100 * self.hits // lookups}% hit rate), "
+			f"{size / (1024 * 1024):.1f} of {self.size_limit_mb} MB used", 0)
+		self.hits = 0
+		self.misses = 0
+
+
+global_object_cache = ObjectCache()
@@ -1,17 +1,54 @@
 import os
+import sys
+import time
 import shutil
 import importlib.util
 from pathlib import Path
 import Errors
+import Jobs
 import Toolchain
+import Cache
+import BuildGraph
+import BuildState
+import SourceScan
+import Trace
 
 global_project_path = "."
 
+global_loaded_projects = {}
+"""Absolute project path -> project, every project file is executed once per process"""
+
 
 def file_mod_time(path):
 	return Path(path).stat().st_mtime
 
 
+def load_project(project_path):
+	global global_project_path
+	project_path = os.path.abspath(project_path)
+	if project_path in global_loaded_projects:
+		return global_loaded_projects[project_path]
+
+	if not os.path.exists(project_path):
+		raise Errors.CBuildError(f"No such project file {project_path}")
+
+	with Trace.span(f"load {os.path.basename(project_path)}", "load", path=project_path):
+		# load module
+		spec = importlib.util.spec_from_file_location(project_path, project_path)
+		module = importlib.util.module_from_spec(spec)
+		# pass arguments to the module and execute it
+		module.cbuild = sys.modules[__name__]
+		global_project_path = project_path
+		spec.loader.exec_module(module)
+
+		# initialize project, it is registered before its dependencies so that cycles terminate
+		project = module.Project()
+		project.find_project_files()
+	global_loaded_projects[project_path] = project
+	project.load_dependencies(sys.modules[__name__])
+	return project
+
+
 class BaseProject:
 	def __init__(self):
 		# project configuration
@@ -21,60 +58,96 @@ class BaseProject:
 		self.output_directory = "bin"
 		self.library_output_directory = "lib"
 		self.temp_directory = os.path.join(self.library_output_directory, "tmp")
-		self.sources = []
-		self.headers = []
+		self.sources = None
+		self.headers = None
 		self.dependencies = []
 		self.preprocessor_definitions = []
 		self.additional_include_dirs = []
 		self.additional_lib_dirs = []
 		self.additional_libraries = []
+		self.unity_build = None
+		"""Merge sources into batch translation units, None follows the configuration"""
+		self.unity_batch_size = None
+		"""Sources per unity batch, None follows the configuration"""
+		self.unity_excluded_sources = []
+		"""Sources that break when merged with others and are always compiled alone"""
+		self.precompiled_header = None
+		"""Header precompiled once per configuration and included into every source, exported to matching dependents"""
+		self.library_type = None
+		"""Build a library project as a 'static' archive or a 'shared' object, None follows the configuration"""
+		self.position_independent = []
+		"""Configurations compiling position independent code, set by the build graph when the objects end up in a shared object"""
+		self.dependency_sets = {}
+		"""Configuration name -> transitive include directories, library directories and libraries, resolved by the build graph"""
 		self.project_path = global_project_path
 		self.project_dir = os.path.dirname(global_project_path)
-
-		self.sources = self.find_files(".", [".cpp"])
-		self.headers = self.find_files(".", [".hpp", ".h"])
+		self.scanned_directories = {}
+		"""Directories searched for files -> their modification time during the search"""
 
 	def project_type(self) -> str:
 		return "None"
 
-	def find_files(self, relative_directory: str, extensions: list, recursive: bool = True) -> list:
+	@property
+	def sources(self) -> list:
+		"""Sources of the project, found in the project directory on first use unless the project lists them itself"""
+		if self._sources is None:
+			self.find_project_files()
+		return self._sources
+
+	@sources.setter
+	def sources(self, sources):
+		self._sources = sources
+
+	@property
+	def headers(self) -> list:
+		"""Headers of the project, found in the project directory on first use unless the project lists them itself"""
+		if self._headers is None:
+			self.find_project_files()
+		return self._headers
+
+	@headers.setter
+	def headers(self, headers):
+		self._headers = headers
+
+	def scan_files(self, relative_directory: str, extensions: list, recursive: bool = True) -> dict:
+		"""Finds files of all extensions in one pass, skipping ignored and output directories"""
 		extensions = ["." + ext if not ext.startswith(".") else ext for ext in extensions]
-		file_list = []
 		directory = os.path.join(self.project_dir, relative_directory)
-		for root, dirs, files in os.walk(directory):
-			for file in files:
-				if any(file.endswith(ext) for ext in extensions):
-					file_path = os.path.join(root, file)
-					if recursive or root == directory:
-						# Add the file path to the list of found files
-						file_list.append(os.path.relpath(file_path, self.project_dir))
-		return file_list
+
+		with Trace.span(f"scan {self.name}", "scan", directory=directory):
+			found, scanned = SourceScan.scan(directory, extensions, set(self.ignore_directories), self.output_paths(), recursive)
+		self.scanned_directories.update(scanned)
+		return {extension: [os.path.relpath(path, self.project_dir) for path in files] for extension, files in found.items()}
+
+	def output_paths(self) -> set:
+		"""Directories the build writes to, never searched for files"""
+		output_directories = [self.output_directory, self.library_output_directory, self.temp_directory]
+		return {os.path.normpath(os.path.join(self.project_dir, output)) for output in output_directories}
+
+	def find_files(self, relative_directory: str, extensions: list, recursive: bool = True) -> list:
+		return [file for files in self.scan_files(relative_directory, extensions, recursive).values() for file in files]
+
+	def find_project_files(self):
+		"""
+		Fills in sources and headers the project did not list itself. Runs when the constructor first reads either list,
+		so ignored directories set before that are respected, or after the constructor at the latest.
+		"""
+		if self._sources is not None and self._headers is not None:
+			return
+		found = self.scan_files(".", [".cpp", ".hpp", ".h"])
+		if self._sources is None:
+			self._sources = found[".cpp"]
+		if self._headers is None:
+			self._headers = found[".hpp"] + found[".h"]
 
 	def load_dependencies(self, module_self):
-		wd = self.push_wd()
 		dependencies = []
 		for dep in self.dependencies:
-
-			# Load module
 			filename, extension = os.path.splitext(dep)
 			if extension == "":
 				dep += ".py"
-			path = os.path.abspath(dep)
-
-			spec = importlib.util.spec_from_file_location(path, path)
-			module = importlib.util.module_from_spec(spec)
-
-			# Pass arguments to the module and execute it
-			module.cbuild, module_self.global_project_path = module_self, path
-			spec.loader.exec_module(module)
-
-			# Initialize project and add it to dependencies
-			project = module.Project()
-			project.load_dependencies(module_self)
-			dependencies.append(project)
-
+			dependencies.append(module_self.load_project(os.path.join(self.project_dir, dep)))
 		self.dependencies = dependencies
-		self.pop_wd(wd)
 
 	def absolute_lib_dir(self, config):
 		return os.path.join(self.project_dir, self.library_output_directory, f"{self.name}-{config.name}")
@@ -85,54 +158,258 @@ class BaseProject:
 	def absolute_temp_dir(self, config):
 		return os.path.join(self.project_dir, self.temp_directory, f"{self.name}-{config.name}")
 
-	def available_includes(self) -> list:
-		includes = [os.path.join(self.project_dir, include_dir) for include_dir in self.public_directories]
-		for dep in self.dependencies:
-			includes += dep.available_includes()
-		return includes
+	def public_includes(self) -> list:
+		return [os.path.join(self.project_dir, include_dir) for include_dir in self.public_directories]
+
+	def resolved_dependency_sets(self, config) -> dict:
+		"""Transitive sets of this project, resolved for the whole graph on first use when it is built outside of one"""
+		if config.name not in self.dependency_sets:
+			BuildGraph.BuildGraph(self).resolve_dependency_sets(config)
+		return self.dependency_sets[config.name]
+
+	def available_includes(self, config) -> list:
+		return list(self.resolved_dependency_sets(config)["includes"])
+
+	def include_directories(self, config) -> list:
+		"""Include directories the sources of this project are compiled with"""
+		return self.available_includes(config) + [self.absolute_path(include) for include in self.additional_include_dirs]
+
+	def shared_library(self, config) -> bool:
+		return False
+
+	def position_independent_code(self, config) -> bool:
+		return config.name in self.position_independent
+
+	def library_file(self, config) -> str:
+		return os.path.join(self.absolute_lib_dir(config), Toolchain.library_name(self.name))
+
+	def linked_library(self, config) -> str:
+		"""Library file name dependents link against"""
+		return Toolchain.library_name(self.name)
+
+	def interface_file(self, config) -> str:
+		"""File the dependents relink on when it changes"""
+		return self.output_file(config)
 
 	def available_libraries(self, config) -> (list, list):
-		libs = [Toolchain.library_name(self.name)] + self.additional_libraries
-		lib_dirs = [self.absolute_lib_dir(config)] + self.additional_lib_dirs
-		for dep in self.dependencies:
-			dep_libs, dep_lib_dirs = dep.available_libraries(config)
-			libs += dep_libs
-			lib_dirs += dep_lib_dirs
-		return libs, lib_dirs
+		"""Libraries in link order, starting with the own one, and their directories"""
+		sets = self.resolved_dependency_sets(config)
+		return list(sets["libraries"]), list(sets["library_directories"])
 
 	def success_time(self, config) -> int:
 		return 0
 
-	def compile_sources(self, forced, config) -> (bool, bool, list):
-		wd = self.push_wd()
+	def absolute_path(self, path) -> str:
+		return os.path.normpath(os.path.join(self.project_dir, path))
 
-		if self.success_time(config):
-			if self.success_time(config) < file_mod_time(self.project_path):
-				Errors.log("Forcing rebuild of sources as project file has changed", 0)
-				forced = True
+	def lto_cache_directory(self, config) -> str:
+		"""ThinLTO cache of the links of this project, kept between builds"""
+		return os.path.join(self.absolute_temp_dir(config), "lto-cache")
 
-		success_time = self.success_time(config)
-		header_times = [file_mod_time(header) for header in self.headers]
-		source_times = [file_mod_time(source) for source in self.sources]
+	def build_state(self, config) -> BuildState.BuildState:
+		return BuildState.get(os.path.join(self.absolute_temp_dir(config), "build-state.jsonl"))
 
-		api_changed = any(header > success_time for header in header_times)
-		src_changed = any(source > success_time for source in source_times)
+	def dependency_outputs(self, config) -> list:
+		"""Output files of every project this one depends on, directly or transitively"""
+		outputs = []
+		for dep in self.dependencies:
+			for output in dep.dependency_outputs(config) + [dep.output_file(config)]:
+				if output not in outputs:
+					outputs.append(output)
+		return outputs
+
+	def dependency_link_inputs(self, config) -> list:
+		"""
+		Files the content of the dependencies is linked from, thin archives only reference their objects
+		and shared objects are represented by their exported symbols.
+		"""
+		inputs = []
+		queue = list(self.dependencies)
+		visited = set()
+		while queue:
+			dep = queue.pop(0)
+			if dep.project_path in visited:
+				continue
+			visited.add(dep.project_path)
+			inputs.append(dep.interface_file(config))
+			if config.thin_archives == "True" and not dep.shared_library(config):
+				inputs += [dep.object_file(source, config) for source in dep.translation_units(config)]
+			queue.extend(dep.dependencies)
+		return inputs
+
+	def runtime_directories(self, config) -> list:
+		"""Directories of the shared objects this project loads at runtime, directly or transitively"""
+		directories = []
+		queue = list(self.dependencies)
+		while queue:
+			dep = queue.pop(0)
+			if dep.shared_library(config) and dep.absolute_lib_dir(config) not in directories:
+				directories.append(dep.absolute_lib_dir(config))
+			queue.extend(dep.dependencies)
+		return directories
+
+	def package(self, objects, forced, config) -> bool:
+		"""Archives the objects into the project library unless none of them changed, returns whether the library changed"""
+		state = self.build_state(config)
+		toolchain = Toolchain.get(config)
+		library_file = self.library_file(config)
+		package_command = toolchain.package_command(objects, library_file, config)
+		if not forced and not state.outdated(library_file, objects, package_command):
+			return False
+
+		# objects rebuilt with identical content are not replaced, so the archive and its dependents stay untouched
+		changes = None if forced else state.changed_inputs(library_file, objects, lambda previous: toolchain.package_command(previous, library_file, config))
+		changed, removed = changes if changes else (None, None)
+		toolchain.package_objects(objects, library_file, config, changed, removed)
+		state.record(library_file, objects, package_command, content_inputs=True)
+		Errors.log(f"{os.path.relpath(library_file, self.project_dir)}", 0)
+		return True
+
+	def precompiled_header_output(self, config) -> str:
+		return os.path.join(self.absolute_temp_dir(config), os.path.splitext(os.path.basename(self.precompiled_header))[0] + ".pch")
+
+	def precompiled_header_key(self, config) -> str:
+		"""Precompiled headers can only be shared by projects compiling with the same definitions and options"""
+		options = [f"{name}={value}" for name, value in sorted(vars(config).items()) if name != "name"]
+		options.append(f"position_independent={self.position_independent_code(config)}")
+		return Cache.hash_strings(options + list(self.preprocessor_definitions))
+
+	def available_precompiled_header(self, config):
+		"""Own precompiled header or the one exported by the closest dependency with a matching key"""
+		if self.precompiled_header:
+			return self.precompiled_header_output(config)
+
+		key = self.precompiled_header_key(config)
+		queue = list(self.dependencies)
+		while queue:
+			dep = queue.pop(0)
+			if dep.precompiled_header and dep.precompiled_header_key(config) == key:
+				return dep.precompiled_header_output(config)
+			queue.extend(dep.dependencies)
+		return None
+
+	def compile_precompiled_header(self, forced, includes, config, signatures: dict) -> bool:
+		state = self.build_state(config)
+		toolchain = Toolchain.get(config)
+		header = self.absolute_path(self.precompiled_header)
+		output = self.precompiled_header_output(config)
+
+		command = toolchain.precompile_header_command(header, output, includes, self.preprocessor_definitions, config, self.position_independent_code(config))
+		if not forced and not state.outdated(output, command=command, signatures=signatures):
+			return False
+
+		toolchain.precompile_header(header, output, includes, self.preprocessor_definitions, config, self.position_independent_code(config))
+		state.record(output, Toolchain.read_depfile(Toolchain.depfile_name(output), self.project_dir), command)
+		Errors.log(f"{self.precompiled_header} -> {os.path.relpath(output, self.project_dir)}", 0)
+		return True
+
+	def unity_enabled(self, config) -> bool:
+		return self.unity_build if self.unity_build is not None else config.unity == "True"
+
+	def unity_batches(self, config) -> dict:
+		"""
+		Unity batch source -> its members. Sources are assigned to batches by a hash of their path, so adding or removing
+		a source only changes its own batch until the number of batches doubles or halves.
+		"""
+		batch_size = int(self.unity_batch_size or config.unity_batch_size)
+		excluded = {os.path.normpath(source) for source in self.unity_excluded_sources}
+		members = sorted(source for source in self.sources if os.path.normpath(source) not in excluded)
+		unity_dir = os.path.join(self.absolute_temp_dir(config), "unity")
+
+		batch_count = 1
+		while batch_count * batch_size < len(members):
+			batch_count *= 2
+
+		batches = {}
+		for member in members:
+			index = int(Cache.hash_strings([os.path.normpath(member)])[:8], 16) % batch_count
+			batches.setdefault(os.path.join(unity_dir, f"{self.name}-unity-{index}.cpp"), []).append(member)
+		return dict(sorted(batches.items()))
+
+	def write_unity_batches(self, config):
+		"""Writes the unity batch sources, files are only rewritten when their content changes"""
+		if not self.unity_enabled(config):
+			return
+		for batch, members in self.unity_batches(config).items():
+			content = "".join(f"#include \"{self.absolute_path(member)}\"\n" for member in members)
+			if os.path.exists(batch):
+				with open(batch) as f:
+					if f.read() == content:
+						continue
+			os.makedirs(os.path.dirname(batch), exist_ok=True)
+			with open(batch, "w") as f:
+				f.write(content)
+
+	def translation_units(self, config) -> list:
+		"""Sources handed to the compiler, unity batches in place of their members"""
+		if not self.unity_enabled(config):
+			return list(self.sources)
+		excluded = {os.path.normpath(source) for source in self.unity_excluded_sources}
+		return list(self.unity_batches(config)) + [source for source in self.sources if os.path.normpath(source) in excluded]
+
+	def object_file(self, source, config) -> str:
+		if os.path.isabs(source):
+			return os.path.join(self.absolute_temp_dir(config), "unity", f"{os.path.splitext(os.path.basename(source))[0]}.o")
+		return os.path.join(self.absolute_temp_dir(config), f"{os.path.splitext(source)[0]}.o")
 
-		includes = self.available_includes() + self.additional_include_dirs
-		outputs = [os.path.join(self.absolute_temp_dir(config), f"{os.path.splitext(src)[0]}.o") for src in self.sources]
+	def compile_sources(self, forced, config) -> (bool, bool, list):
+		# projects of a graph are built concurrently, so everything here works with absolute paths
+		state = self.build_state(config)
+		signatures = {}
 
-		toolchain = Toolchain.get(config)
+		headers = [self.absolute_path(header) for header in self.headers]
+		api_changed = state.outdated(":api", headers, signatures=signatures)
 
-		forced |= api_changed
+		includes = self.include_directories(config)
+		self.write_unity_batches(config)
+		sources = self.translation_units(config)
+		outputs = [self.object_file(source, config) for source in sources]
 
-		for source, output, time in zip(self.sources, outputs, source_times):
-			if forced or time > success_time:
-				toolchain.compile_object(source, output, includes, self.preprocessor_definitions, config)
-				Errors.log(f"{source} -> {os.path.relpath(output, self.project_dir)}", 0)
-				src_changed = True
+		toolchain = Toolchain.get(config)
 
-		self.pop_wd(wd)
-		return api_changed, src_changed, outputs
+		pch = self.available_precompiled_header(config)
+		if self.precompiled_header:
+			self.compile_precompiled_header(forced, includes, config, signatures)
+
+		def compile_task(source, output, command):
+			def task():
+				absolute_source = self.absolute_path(source)
+				try:
+					toolchain.compile_object(absolute_source, output, includes, self.preprocessor_definitions, config, pch, self.position_independent_code(config))
+				except Toolchain.ToolchainError:
+					state.record(output, [absolute_source], command, "failure")
+					raise
+				inputs = Toolchain.read_depfile(Toolchain.depfile_name(output), self.project_dir)
+				if pch and pch not in inputs:
+					inputs.append(pch)
+				if config.profile_use:
+					inputs.append(config.profile_use)
+				state.record(output, inputs, command)
+				Errors.log(f"{os.path.relpath(absolute_source, self.project_dir)} -> {os.path.relpath(output, self.project_dir)}", 0)
+			return task
+
+		# objects are compared against the exact command line, so flag changes rebuild only what they affect
+		tasks = []
+		with Trace.span(f"check {self.name}", "check", sources=len(sources)):
+			for source, output in zip(sources, outputs):
+				command = toolchain.compile_command(self.absolute_path(source), output, includes, self.preprocessor_definitions, config, pch, self.position_independent_code(config))
+				if forced or state.outdated(output, command=command, signatures=signatures):
+					tasks.append(compile_task(source, output, command))
+
+		start_time = time.perf_counter()
+		Jobs.run(tasks)
+
+		if len(tasks):
+			mode = f"unity build, batch size {self.unity_batch_size or config.unity_batch_size}" if self.unity_enabled(config) else "normal build"
+			Errors.log(f"Compiled {len(tasks)} translation units in {time.perf_counter() - start_time:.2f}s ({mode})", 1)
+
+		return api_changed, len(tasks) > 0, outputs
+
+	def finish_build(self, config):
+		"""Records the public headers the api change of the next build is decided against"""
+		state = self.build_state(config)
+		state.record(":api", [self.absolute_path(header) for header in self.headers], None)
+		state.compact()
 
 	def clear(self, config):
 		wd = self.push_wd()
@@ -142,8 +419,13 @@ class BaseProject:
 				shutil.rmtree(directory)
 		self.pop_wd(wd)
 
-	def compile(self, config):
-		pass
+	def compile(self, config, forced=False) -> (bool, bool):
+		"""Builds the project after every project it depends on"""
+		return BuildGraph.BuildGraph(self).build(config, forced)
+
+	def compile_node(self, config, forced, dep_api_changed, dep_lib_changed) -> (bool, bool):
+		"""Builds this project alone, dependencies are already built and report whether their api or libraries changed"""
+		return False, dep_lib_changed
 
 	def recompile(self, config):
 		self.clear(config)
@@ -165,34 +447,73 @@ class LibraryProject(BaseProject):
 	def project_type(self) -> str:
 		return "library"
 
-	def output_file(self, config):
-		return os.path.join(self.absolute_lib_dir(config), Toolchain.library_name(self.name))
+	def shared_library(self, config) -> bool:
+		return (self.library_type or config.library_type) == "shared"
 
-	def success_time(self, config):
-		lib_path = self.output_file(config)
-		return file_mod_time(lib_path) if os.path.exists(lib_path) else 0
+	def shared_object_file(self, config) -> str:
+		return os.path.join(self.absolute_lib_dir(config), Toolchain.shared_object_name(self.name))
 
-	def compile(self, config, forced=False):
-		wd = self.push_wd()
-		Errors.log(f" == Building \'{self.name}\' == ", 0)
+	def output_file(self, config):
+		return self.shared_object_file(config) if self.shared_library(config) else self.library_file(config)
 
-		dep_api_changed = False
-		dep_lib_changed = False
-		
-		for dep in self.dependencies:
-			api_change, lib_change = dep.ProjectCompile(config, forced)
-			dep_api_changed |= api_change
-			dep_lib_changed |= lib_change
+	def linked_library(self, config) -> str:
+		return os.path.basename(self.output_file(config))
 
-		self_api_changed, self_lib_changed, objects = self.compile_sources(dep_api_changed, config)
+	def interface_file(self, config) -> str:
+		"""Shared objects are represented by their exported symbols, so changes to the implementation do not relink dependents"""
+		if self.shared_library(config):
+			return self.shared_object_file(config) + ".abi"
+		return self.output_file(config)
 
-		if self_lib_changed or self_api_changed or dep_api_changed or dep_lib_changed:
-			toolchain = Toolchain.get(config)
-			library_file = self.output_file(config)
-			toolchain.package_objects(objects, library_file, config)
-			Errors.log(f"{os.path.relpath(library_file, self.project_dir)}", 0)
+	def success_time(self, config):
+		lib_path = self.output_file(config)
+		return file_mod_time(lib_path) if os.path.exists(lib_path) else 0
 
-		self.pop_wd(wd)
+	def link_shared(self, objects, forced, config) -> bool:
+		"""Links the shared object unless its inputs are unchanged, returns whether its exported symbols changed"""
+		state = self.build_state(config)
+		toolchain = Toolchain.get(config)
+		output = self.shared_object_file(config)
+		interface = self.interface_file(config)
+
+		libraries, library_search_directories = self.available_libraries(config)
+		libraries.remove(self.linked_library(config))
+		library_search_directories.remove(self.absolute_lib_dir(config))
+		link_command = toolchain.link_command(objects, output, libraries, library_search_directories, config, self.runtime_directories(config), True, self.lto_cache_directory(config))
+		link_inputs = objects + self.dependency_link_inputs(config)
+		if not forced and os.path.exists(interface) and not state.outdated(output, link_inputs, link_command):
+			return False
+
+		toolchain.link_objects(objects, output, libraries, library_search_directories, config, self.runtime_directories(config), True, self.lto_cache_directory(config))
+		state.record(output, link_inputs, link_command, content_inputs=True)
+		Errors.log(f"{os.path.relpath(output, self.project_dir)}", 0)
+
+		# the interface file is only rewritten when the exported symbols change, dependents relink on it
+		symbols = toolchain.exported_symbols(output)
+		if os.path.exists(interface):
+			with open(interface) as f:
+				if f.read() == symbols:
+					Errors.log("Exported symbols unchanged, dependents are not relinked", 1)
+					return False
+		with open(interface, "w") as f:
+			f.write(symbols)
+		return True
+
+	def compile_node(self, config, forced, dep_api_changed, dep_lib_changed) -> (bool, bool):
+		Errors.log(f" == Building \'{self.name}\' ({config.name}) == ", 0)
+
+		self_api_changed, _, objects = self.compile_sources(forced, config)
+		if self.shared_library(config):
+			# a stale archive would be linked in place of the shared object by projects linking statically
+			Toolchain.clear_output(self.library_file(config))
+			self_lib_changed = self.link_shared(objects, forced, config)
+		else:
+			# the linker prefers a stale shared object over the archive
+			Toolchain.clear_output(self.shared_object_file(config))
+			Toolchain.clear_output(self.shared_object_file(config) + ".abi")
+			self_lib_changed = self.package(objects, forced, config)
+
+		self.finish_build(config)
 		return self_api_changed, (self_lib_changed or dep_lib_changed)
 
 
@@ -210,55 +531,50 @@ class BinaryProject(BaseProject):
 		path = self.output_file(config)
 		return file_mod_time(path) if os.path.exists(path) else 0
 
-	def compile(self, config, forced=False):
-		wd = self.push_wd()
-		Errors.log(f" == Building \'{self.name}\' == ", 0)
-
-		if self.success_time(config):
-			if os.path.exists(config.name + ".json") and self.success_time(config) < file_mod_time(config.name + ".json"):
-				Errors.log("Forcing recursive rebuild as configuration has changed since last successful run", 0)
-				forced = True
+	def link_libraries(self, config) -> (list, list):
+		"""Libraries and their directories the executable links against, its own objects are linked directly"""
+		libraries, library_search_directories = self.available_libraries(config)
+		libraries.remove(Toolchain.library_name(self.name))
+		library_search_directories.remove(self.absolute_lib_dir(config))
+		return libraries, library_search_directories
 
-		dep_api_changed = False
-		dep_lib_changed = False
+	def compile_node(self, config, forced, dep_api_changed, dep_lib_changed) -> (bool, bool):
+		Errors.log(f" == Building \'{self.name}\' ({config.name}) == ", 0)
 
-		if len(self.dependencies):
-			Errors.log("Building dependencies", 1)
-			for dep in self.dependencies:
-				api_change, lib_change = dep.compile(config, forced)
-				dep_api_changed |= api_change
-				dep_lib_changed |= lib_change
-			Errors.log("Done building dependencies", 1)
+		self_api_changed, _, objects = self.compile_sources(forced, config)
+		self.package(objects, forced, config)
 
-		if dep_api_changed:
-			Errors.log(f"Forcing rebuild of \'{self.name}\' as api of dependencies has changed", 1)
-			forced = True
-
-		self_api_changed, self_lib_changed, objects = self.compile_sources(forced, config)
-
-		if self_lib_changed or dep_lib_changed or dep_api_changed or self_api_changed or forced:
-			toolchain = Toolchain.get(config)
-
-			# create static library
-			library_output = os.path.join(self.absolute_lib_dir(config), Toolchain.library_name(self.name))
-			toolchain.package_objects(objects, library_output, config)
-			Errors.log(f"{os.path.relpath(library_output, self.project_dir)}", 0)
-
-			# create executable
-			libraries, library_search_directories = self.available_libraries(config)
-			libraries.remove(Toolchain.library_name(self.name))
-			library_search_directories.remove(self.absolute_lib_dir(config))
-			toolchain.link_objects(objects, self.output_file(config), libraries, library_search_directories, config)
-			Errors.log(f"{os.path.relpath(self.output_file(config), self.project_dir)}", 0)
+		state = self.build_state(config)
+		toolchain = Toolchain.get(config)
 
-		self.pop_wd(wd)
+		# create executable, inputs are compared by content so rebuilt but identical objects and libraries do not relink
+		libraries, library_search_directories = self.link_libraries(config)
+		runtime_directories = self.runtime_directories(config)
+		link_command = toolchain.link_command(objects, self.output_file(config), libraries, library_search_directories, config, runtime_directories, lto_cache=self.lto_cache_directory(config))
+		link_inputs = objects + self.dependency_link_inputs(config)
+		self_lib_changed = False
+		if forced or state.outdated(self.output_file(config), link_inputs, link_command):
+			previous = state.records.get(self.output_file(config), {}).get("duration")
+			start_time = time.perf_counter()
+			toolchain.link_objects(objects, self.output_file(config), libraries, library_search_directories, config, runtime_directories, lto_cache=self.lto_cache_directory(config))
+			duration = time.perf_counter() - start_time
+			state.record(self.output_file(config), link_inputs, link_command, content_inputs=True, duration=duration)
+
+			timing = f"linked in {duration:.2f}s with the {config.linker} linker" + (f" and {config.lto} lto" if config.lto != "off" else "")
+			if previous is not None:
+				timing += f", previous link took {previous:.2f}s"
+			Errors.log(f"{os.path.relpath(self.output_file(config), self.project_dir)} ({timing})", 0)
+			self_lib_changed = True
+
+		self.finish_build(config)
+		return self_api_changed, (self_lib_changed or dep_lib_changed)
 
-	def run(self, config):
+	def run(self, config, arguments=()):
 		wd = self.push_wd()
-		Toolchain.get(config).run(self.output_file(config))
+		Toolchain.get(config).run(self.output_file(config), self.runtime_directories(config), arguments)
 		self.pop_wd(wd)
 
 	def debug(self, config):
 		wd = self.push_wd()
-		Toolchain.get(config).debug(self.output_file(config))
+		Toolchain.get(config).debug(self.output_file(config), self.runtime_directories(config))
 		self.pop_wd(wd)
@@ -0,0 +1,94 @@
+import os
+import json
+import Errors
+import Toolchain
+
+template_events = {"InstantiateClass", "InstantiateFunction", "ParseTemplate"}
+"""Clang time trace events attributed to a template or class named in their detail"""
+
+
+class CompileAnalysis:
+	"""
+	Totals of the clang time traces written by objects compiled with the time_trace option.
+	Header and template times are inclusive, a header is charged for everything it includes.
+	"""
+
+	def __init__(self):
+		self.headers = {}
+		"""Header -> [total microseconds, times parsed]"""
+		self.templates = {}
+		"""Template -> [total microseconds, times instantiated]"""
+		self.translation_units = {}
+		"""Source -> {"frontend", "backend", "total"} microseconds"""
+		self.missing = []
+		"""Translation units without a time trace"""
+
+	def add(self, source, trace_path):
+		with open(trace_path) as f:
+			events = json.load(f).get("traceEvents", [])
+
+		times = {"frontend": 0, "backend": 0, "total": 0}
+		for event in events:
+			if event.get("ph") != "X":
+				continue
+			name = event.get("name")
+			duration = event.get("dur", 0)
+			detail = event.get("args", {}).get("detail")
+			if name == "Source" and detail:
+				entry = self.headers.setdefault(detail, [0, 0])
+				entry[0] += duration
+				entry[1] += 1
+			elif name in template_events and detail:
+				entry = self.templates.setdefault(detail, [0, 0])
+				entry[0] += duration
+				entry[1] += 1
+			elif name == "Frontend":
+				times["frontend"] += duration
+			elif name == "Backend":
+				times["backend"] += duration
+			elif name == "ExecuteCompiler":
+				times["total"] += duration
+		self.translation_units[source] = times
+
+	def ranked(self, count: int) -> dict:
+		def top(entries):
+			ordered = sorted(entries.items(), key=lambda item: item[1][0], reverse=True)[:count]
+			return [{"name": name, "total_ms": total / 1000, "count": times} for name, (total, times) in ordered]
+
+		units = sorted(self.translation_units.items(), key=lambda item: item[1]["total"], reverse=True)[:count]
+		return {
+			"headers": top(self.headers),
+			"templates": top(self.templates),
+			"translation_units": [{"source": source, **{phase: time / 1000 for phase, time in times.items()}} for source, times in units],
+			"missing_traces": self.missing,
+		}
+
+
+def analyze(projects, config) -> CompileAnalysis:
+	analysis = CompileAnalysis()
+	for project in projects:
+		for source in project.translation_units(config):
+			trace_path = Toolchain.time_trace_name(project.object_file(source, config))
+			absolute_source = project.absolute_path(source)
+			if not os.path.exists(trace_path):
+				analysis.missing.append(absolute_source)
+				continue
+			try:
+				analysis.add(absolute_source, trace_path)
+			except (OSError, ValueError) as error:
+				Errors.warn(f"Unable to read time trace '{trace_path}' : {error}")
+	return analysis
+
+
+def report(ranked: dict):
+	Errors.log("Headers by total parse time:", 0)
+	for entry in ranked["headers"]:
+		Errors.log(f"\t{entry['total_ms']:10.1f} ms  {entry['count']:5}x  {entry['name']}", 0)
+	Errors.log("Template instantiations by total time:", 0)
+	for entry in ranked["templates"]:
+		Errors.log(f"\t{entry['total_ms']:10.1f} ms  {entry['count']:5}x  {entry['name']}", 0)
+	Errors.log("Translation units by compile time (frontend / backend):", 0)
+	for entry in ranked["translation_units"]:
+		Errors.log(f"\t{entry['total']:10.1f} ms  {entry['frontend']:10.1f} / {entry['backend']:<10.1f}  {entry['source']}", 0)
+	if ranked["missing_traces"]:
+		Errors.warn(f"{len(ranked['missing_traces'])} translation units have no time trace, compile them with the time_trace option enabled")
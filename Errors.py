@@ -1,20 +1,48 @@
+import contextlib
+import threading
 
 global_verbose_level = 3
 
+output_lock = threading.Lock()
+"""Serializes console output of concurrently running jobs"""
+thread_output = threading.local()
+
 
 class CBuildError(Exception):
 	def __init__(self, message):
 		super().__init__(message)
 
 
+def write(message):
+	buffer = getattr(thread_output, "buffer", None)
+	if buffer is not None:
+		buffer.append(message)
+		return
+	with output_lock:
+		print(message)
+
+
+@contextlib.contextmanager
+def grouped():
+	"""Holds back the output of the current thread and prints it as one contiguous block"""
+	thread_output.buffer = []
+	try:
+		yield
+	finally:
+		buffer, thread_output.buffer = thread_output.buffer, None
+		if buffer:
+			with output_lock:
+				print("\n".join(buffer))
+
+
 def log(message, verbose_level: int = 0):
 	if verbose_level < global_verbose_level:
-		print(message)
+		write(message)
 
 
 def warn(message):
-	print(f"\033[33mWARNING {message}\033[0m")
+	write(f"\033[33mWARNING {message}\033[0m")
 
 
 def err(message):
-	print(f"\033[31mERROR {message}\033[0m")
+	write(f"\033[31mERROR {message}\033[0m")
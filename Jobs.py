@@ -0,0 +1,65 @@
+import os
+import threading
+import contextlib
+import concurrent.futures
+import Errors
+
+global_jobs = os.cpu_count() or 1
+"""Maximum number of build jobs running at the same time"""
+job_slots = threading.BoundedSemaphore(global_jobs)
+"""Held by every tool process so that concurrently built projects share the job limit"""
+free_slots = list(range(global_jobs))
+"""Numbers of the job slots nobody holds"""
+free_slots_lock = threading.Lock()
+
+
+def set_jobs(jobs):
+	global global_jobs, job_slots, free_slots
+	try:
+		jobs = int(jobs)
+	except ValueError:
+		raise Errors.CBuildError(f"Invalid job count '{jobs}' - must be a positive number")
+	if jobs < 1:
+		raise Errors.CBuildError(f"Invalid job count '{jobs}' - must be a positive number")
+	global_jobs = jobs
+	job_slots = threading.BoundedSemaphore(jobs)
+	free_slots = list(range(jobs))
+
+
+@contextlib.contextmanager
+def job_slot():
+	"""Holds one of the job slots and yields its number"""
+	with job_slots:
+		with free_slots_lock:
+			slot = free_slots.pop()
+		try:
+			yield slot
+		finally:
+			with free_slots_lock:
+				free_slots.append(slot)
+
+
+def grouped_task(task):
+	with Errors.grouped():
+		return task()
+
+
+def run(tasks: list) -> list:
+	"""
+	Runs callables on a pool of at most global_jobs workers and returns their results in order.
+	Output of every task is printed as one block. The first failure cancels the tasks that
+	have not started yet, waits for the running ones and is raised to the caller.
+	"""
+	if global_jobs <= 1 or len(tasks) <= 1:
+		return [task() for task in tasks]
+
+	results = [None] * len(tasks)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=min(global_jobs, len(tasks)), thread_name_prefix="cbuild-job") as pool:
+		futures = {pool.submit(grouped_task, task): index for index, task in enumerate(tasks)}
+		try:
+			for future in concurrent.futures.as_completed(futures):
+				results[futures[future]] = future.result()
+		except BaseException:
+			pool.shutdown(wait=True, cancel_futures=True)
+			raise
+	return results
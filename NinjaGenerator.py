@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import shlex
+import platform
+import subprocess
+import Toolchain
+import BuildGraph
+import BuildStamp
+
+cbuild_script = os.path.join(BuildStamp.cbuild_dir, "cbuild.py")
+
+
+def shell_command(command: list) -> str:
+	if platform.system() == "Windows":
+		return subprocess.list2cmdline(command)
+	return shlex.join(command)
+
+
+def escape_path(path: str) -> str:
+	"""Escapes a path for the build and input lists of a ninja statement"""
+	return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def escape_value(value: str) -> str:
+	"""Escapes a variable value, spaces are significant only in paths"""
+	return value.replace("$", "$$")
+
+
+def replacing_command(output, command: list) -> str:
+	"""llvm-ar adds to an existing archive, so it is removed first like Toolchain.package_objects does"""
+	if platform.system() == "Windows":
+		return f"cmd /c if exist {subprocess.list2cmdline([output])} del {subprocess.list2cmdline([output])} && {shell_command(command)}"
+	return f"rm -f {shlex.quote(output)} && {shell_command(command)}"
+
+
+class NinjaFile:
+	def __init__(self):
+		self.lines = []
+
+	def variable(self, name, value, indent=0):
+		self.lines.append("  " * indent + f"{name} = {escape_value(value)}")
+
+	def rule(self, name, **variables):
+		"""Rule variables are written as they are, they refer to the variables of the build statements"""
+		self.lines.append(f"rule {name}")
+		for variable, value in variables.items():
+			self.lines.append(f"  {variable} = {value}")
+		self.lines.append("")
+
+	def build(self, outputs: list, rule, inputs: list, implicit: list = (), **variables):
+		line = f"build {' '.join(escape_path(output) for output in outputs)}: {rule}"
+		if inputs:
+			line += " " + " ".join(escape_path(path) for path in inputs)
+		if implicit:
+			line += " | " + " ".join(escape_path(path) for path in implicit)
+		self.lines.append(line)
+		for variable, value in variables.items():
+			self.variable(variable, value, 1)
+		self.lines.append("")
+
+	def content(self) -> str:
+		return "\n".join(self.lines) + "\n"
+
+
+def generate(root, config, config_name) -> (str, str):
+	"""
+	Writes build.ninja and compile_commands.json next to the root project, running the commands cbuild compile would run.
+	Returns the paths of both files.
+	"""
+	graph = BuildGraph.BuildGraph(root)
+	graph.mark_position_independent(config)
+	graph.resolve_dependency_sets(config)
+	projects = [graph.nodes[path] for path in graph.order]
+	build_directory = root.absolute_temp_dir(config)
+
+	ninja = NinjaFile()
+	ninja.lines.append(f"# generated by 'cbuild generate ninja' for the {config_name} configuration, changes are overwritten")
+	ninja.variable("ninja_required_version", "1.3")
+	ninja.variable("builddir", build_directory)
+	ninja.lines.append("")
+	ninja.rule("compile", command="$cmd", description="$desc", depfile="$depfile", deps="gcc")
+	ninja.rule("archive", command="$cmd", description="$desc")
+	ninja.rule("link", command="$cmd", description="$desc")
+	ninja.rule("regenerate", command="$cmd", description="Regenerating build.ninja", generator="1")
+
+	compile_commands = []
+	defaults = []
+	for project in projects:
+		toolchain = Toolchain.get(config)
+		includes = project.include_directories(config)
+		pch = project.available_precompiled_header(config)
+		relative = lambda path: os.path.relpath(path, project.project_dir)
+		# the batches are sources of the generated build
+		project.write_unity_batches(config)
+
+		if project.precompiled_header:
+			header = project.absolute_path(project.precompiled_header)
+			command = toolchain.precompile_header_command(header, pch, includes, project.preprocessor_definitions, config, project.position_independent_code(config))
+			ninja.build([pch], "compile", [header], cmd=shell_command(command), depfile=Toolchain.depfile_name(pch), desc=f"{project.name}: {project.precompiled_header}")
+
+		objects = []
+		for source in project.translation_units(config):
+			absolute_source = project.absolute_path(source)
+			output = project.object_file(source, config)
+			command = toolchain.compile_command(absolute_source, output, includes, project.preprocessor_definitions, config, pch, project.position_independent_code(config))
+			implicit = [pch] if pch else []
+			ninja.build([output], "compile", [absolute_source], implicit, cmd=shell_command(command), depfile=Toolchain.depfile_name(output), desc=f"{project.name}: {relative(absolute_source)}")
+			compile_commands.append({"directory": project.project_dir, "file": absolute_source, "arguments": command, "output": output})
+			objects.append(output)
+
+		if project.shared_library(config):
+			library = project.output_file(config)
+			libraries, library_directories = project.available_libraries(config)
+			libraries.remove(project.linked_library(config))
+			library_directories.remove(project.absolute_lib_dir(config))
+			command = toolchain.link_command(objects, library, libraries, library_directories, config, project.runtime_directories(config), True, project.lto_cache_directory(config))
+			ninja.build([library], "link", objects, project.dependency_outputs(config), cmd=shell_command(command), desc=f"{project.name}: {relative(library)}")
+		else:
+			library = project.library_file(config)
+			command = toolchain.package_command(objects, library, config)
+			ninja.build([library], "archive", objects, cmd=replacing_command(library, command), desc=f"{project.name}: {relative(library)}")
+		outputs = [library]
+
+		if project.project_type() == "application":
+			executable = project.output_file(config)
+			libraries, library_directories = project.link_libraries(config)
+			command = toolchain.link_command(objects, executable, libraries, library_directories, config, project.runtime_directories(config), lto_cache=project.lto_cache_directory(config))
+			ninja.build([executable], "link", objects, project.dependency_outputs(config), cmd=shell_command(command), desc=f"{project.name}: {relative(executable)}")
+			outputs = [executable]
+		if project is root:
+			defaults = outputs
+
+	# regenerate when a project, its configuration or the file lists change
+	inputs = [BuildStamp.cbuild_files(), BuildStamp.config_files(root.project_path, config_name)]
+	inputs = [path for paths in inputs for path in paths if os.path.exists(path)]
+	for project in projects:
+		inputs.append(project.project_path)
+		# the project directory also changes whenever build output, ninja logs or these files are created in it,
+		# so it only counts when sources live directly in it
+		source_directories = {os.path.dirname(project.absolute_path(file)) for file in project.sources + project.headers}
+		inputs.extend(directory for directory in project.scanned_directories if directory != project.project_dir or directory in source_directories)
+	command = [sys.executable, cbuild_script, "generate", "ninja", root.project_path, config_name]
+	# named the way ninja refers to its manifest when run from the project directory
+	ninja.build(["build.ninja"], "regenerate", [], sorted(set(inputs)), cmd=shell_command(command))
+	ninja.lines.append(f"default {' '.join(escape_path(output) for output in defaults)}")
+
+	# both files are rewritten in place, replacing them would touch the project directory ninja watches
+	commands_path = os.path.join(root.project_dir, "compile_commands.json")
+	with open(commands_path, "w") as f:
+		json.dump(compile_commands, f, indent=2)
+	ninja_path = os.path.join(root.project_dir, "build.ninja")
+	with open(ninja_path, "w") as f:
+		f.write(ninja.content())
+	return ninja_path, commands_path
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+output_limit = 1 << 20
+"""Bytes of output kept for every tool process, output over the limit is dropped from the middle"""
+read_size = 1 << 16
+
+global_loop = None
+"""Event loop every tool process is driven by, running on a daemon thread"""
+global_loop_lock = threading.Lock()
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+	global global_loop
+	with global_loop_lock:
+		if global_loop is None:
+			loop = asyncio.new_event_loop()
+			threading.Thread(target=loop.run_forever, name="cbuild-processes", daemon=True).start()
+			global_loop = loop
+		return global_loop
+
+
+class BoundedOutput:
+	"""Collects process output keeping at most limit bytes of its beginning and end, None keeps everything"""
+
+	def __init__(self, limit=output_limit):
+		self.limit = limit
+		self.head = bytearray()
+		self.tail = bytearray()
+		self.omitted = 0
+
+	def append(self, data: bytes):
+		if self.limit is None:
+			self.head += data
+			return
+
+		room = self.limit // 2 - len(self.head)
+		if room > 0:
+			self.head += data[:room]
+			data = data[room:]
+		self.tail += data
+		excess = len(self.tail) - self.limit // 2
+		if excess > 0:
+			del self.tail[:excess]
+			self.omitted += excess
+
+	def data(self) -> bytes:
+		return bytes(self.head + self.tail)
+
+	def text(self) -> str:
+		text = self.head.decode(errors="replace")
+		if self.omitted:
+			text += f"\n... {self.omitted} bytes of output omitted ...\n"
+		return text + self.tail.decode(errors="replace")
+
+
+async def execute(command: list, consume, merge_errors: bool, env) -> int:
+	if consume is None:
+		# the console is inherited, so the process sees a terminal and does not buffer its output
+		process = await asyncio.create_subprocess_exec(*command, stdin=None, stdout=None, stderr=None, env=env)
+	else:
+		stderr = asyncio.subprocess.STDOUT if merge_errors else asyncio.subprocess.DEVNULL
+		process = await asyncio.create_subprocess_exec(*command, stdin=None, stdout=asyncio.subprocess.PIPE, stderr=stderr, env=env)
+	try:
+		while consume is not None:
+			data = await process.stdout.read(read_size)
+			if not data:
+				break
+			consume(data)
+		return await process.wait()
+	except asyncio.CancelledError:
+		process.kill()
+		await process.wait()
+		raise
+
+
+def run(command: list, consume, merge_errors: bool = True, env=None) -> int:
+	"""
+	Runs the command on the shared event loop and blocks the calling thread until it exits.
+	Output is handed to consume in chunks as it is read, diagnostics included unless merge_errors is False.
+	Without consume the process writes to the console of cbuild directly.
+	Returns the exit code, the process is killed if the caller is interrupted while waiting.
+	The process inherits the environment of cbuild unless env is given.
+	"""
+	future = asyncio.run_coroutine_threadsafe(execute(command, consume, merge_errors, env), event_loop())
+	try:
+		return future.result()
+	except BaseException:
+		future.cancel()
+		raise
@@ -0,0 +1,88 @@
+import os
+import copy
+import json
+import Cache
+import Errors
+import Toolchain
+
+
+def manifest_file(profile) -> str:
+	"""Sources and training runs the profile was recorded with"""
+	return profile + ".json"
+
+
+def source_digests(projects) -> dict:
+	digests = {}
+	for project in projects:
+		for file in project.sources + project.headers:
+			path = project.absolute_path(file)
+			if os.path.exists(path):
+				digests[path] = Cache.file_digest(path)
+	return digests
+
+
+def drift(recorded: dict, current: dict) -> float:
+	"""Fraction of the sources added, removed or changed since the profile was recorded"""
+	paths = recorded.keys() | current.keys()
+	changed = [path for path in paths if recorded.get(path) != current.get(path)]
+	return len(changed) / len(paths) if paths else 0.0
+
+
+def needs_training(profile, projects, runs, threshold) -> bool:
+	if not os.path.exists(profile) or not os.path.exists(manifest_file(profile)):
+		Errors.log("No profile recorded for this configuration, training", 0)
+		return True
+
+	with open(manifest_file(profile)) as f:
+		manifest = json.load(f)
+	if manifest.get("runs") != runs:
+		Errors.log("Training runs changed since the profile was recorded, training", 0)
+		return True
+
+	changed = drift(manifest.get("sources", {}), source_digests(projects))
+	if changed > threshold:
+		Errors.warn(f"Profile is stale, {changed:.0%} of the sources changed since it was recorded (threshold {threshold:.0%}), training")
+		return True
+	if changed:
+		Errors.warn(f"Reusing profile recorded before {changed:.0%} of the sources changed (threshold {threshold:.0%})")
+	else:
+		Errors.log("Reusing profile, no sources changed since it was recorded", 0)
+	return False
+
+
+def raw_profile_directory(project, config) -> str:
+	return os.path.join(project.absolute_temp_dir(config), "profiles")
+
+
+def instrumented_config(project, config):
+	"""Variant of the configuration writing raw profiles, built in output directories of its own"""
+	instrumented = copy.copy(config)
+	instrumented.name = config.name + "-instrumented"
+	instrumented.profile_use = None
+	instrumented.profile_generate = raw_profile_directory(project, instrumented)
+	return instrumented
+
+
+def train(project, config, runs):
+	"""Runs the instrumented executable once for every list of training arguments"""
+	directory = raw_profile_directory(project, config)
+	os.makedirs(directory, exist_ok=True)
+	for name in os.listdir(directory):
+		if name.endswith(".profraw"):
+			os.remove(os.path.join(directory, name))
+
+	for arguments in runs:
+		Errors.log(f"Training run : {project.name} {' '.join(arguments)}", 0)
+		project.run(config, arguments)
+
+
+def merge(project, config, profile, projects, runs):
+	directory = raw_profile_directory(project, config)
+	raw_profiles = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".profraw")]
+	if not raw_profiles:
+		raise Errors.CBuildError(f"Training runs wrote no profiles to '{directory}'")
+
+	Toolchain.get(config).merge_profiles(raw_profiles, profile)
+	with open(manifest_file(profile), "w") as f:
+		json.dump({"runs": runs, "sources": source_digests(projects)}, f, indent=2)
+	Errors.log(f"Merged {len(raw_profiles)} raw profiles into {profile}", 0)
@@ -0,0 +1,147 @@
+import os
+import json
+import types
+import Cache
+import CbuildProjects
+import SourceScan
+
+project_types = {"library": CbuildProjects.LibraryProject, "application": CbuildProjects.BinaryProject}
+
+template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cproj.py")
+forwarding_methods = {"compile", "clear", "recompile"}
+"""Methods of the project template in cproj.py that only forward to the base class"""
+constructor_names = {"super", "__init__", "append", "extend", "insert", "remove"}
+"""Names a constructor may use besides project attributes, anything else could depend on more than the project file"""
+
+global_template_codes = None
+
+
+def snapshot_path(project_path) -> str:
+	return os.path.join(Cache.global_cache_dir, "graphs", Cache.hash_strings([project_path]) + ".json")
+
+
+def modification_time(path):
+	try:
+		return os.stat(path).st_mtime_ns
+	except OSError:
+		return None
+
+
+def code_signature(function) -> tuple:
+	code = function.__code__
+	return code.co_code, code.co_names, code.co_varnames, code.co_consts
+
+
+def template_codes() -> dict:
+	"""Code of the forwarding methods of the project template"""
+	global global_template_codes
+	if global_template_codes is None:
+		with open(template_path) as f:
+			source = f.read().format("LibraryProject", "Template")
+		namespace = {"cbuild": CbuildProjects}
+		exec(compile(source, template_path, "exec"), namespace)
+		global_template_codes = {name: code_signature(getattr(namespace["Project"], name)) for name in forwarding_methods}
+	return global_template_codes
+
+
+def constructor_only_assigns(project, constructor) -> bool:
+	"""
+	The snapshot holds the attributes a constructor set, which is only all it did when it sets attributes
+	and edits their lists without calling anything else.
+	"""
+	code = constructor.__code__
+	if any(isinstance(constant, types.CodeType) for constant in code.co_consts):
+		return False
+	allowed = constructor_names | set(vars(project)) | {"sources", "headers"}
+	return all(name in allowed for name in code.co_names)
+
+
+def can_snapshot(project) -> bool:
+	"""Projects that customize behaviour beyond the template have to be executed on every load"""
+	if project.project_type() not in project_types:
+		return False
+	for name, value in vars(type(project)).items():
+		if not callable(value):
+			continue
+		if name == "__init__":
+			if not constructor_only_assigns(project, value):
+				return False
+		elif name not in forwarding_methods or code_signature(value) != template_codes()[name]:
+			return False
+	return True
+
+
+def save(root):
+	projects = {}
+	files = {CbuildProjects.__file__: modification_time(CbuildProjects.__file__)}
+	directories = {}
+
+	stack = [root]
+	while stack:
+		project = stack.pop()
+		if project.project_path in projects:
+			continue
+		if not can_snapshot(project):
+			return
+
+		attributes = dict(vars(project))
+		attributes["dependencies"] = [dep.project_path for dep in project.dependencies]
+		projects[project.project_path] = {"type": project.project_type(), "attributes": attributes}
+		files[project.project_path] = modification_time(project.project_path)
+		directories.update(project.scanned_directories)
+		stack.extend(project.dependencies)
+
+	snapshot = {"root": root.project_path, "files": files, "directories": directories, "projects": projects}
+	path = snapshot_path(root.project_path)
+	try:
+		content = json.dumps(snapshot)
+	except (TypeError, ValueError):
+		# project holds attributes that can not be restored from json
+		return
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path + ".tmp", "w") as f:
+		f.write(content)
+	os.replace(path + ".tmp", path)
+
+
+def restore(project_path):
+	"""Returns the project graph stored by the last load if no project file or scanned directory changed since"""
+	path = snapshot_path(project_path)
+	if not os.path.exists(path):
+		return None
+	try:
+		with open(path) as f:
+			snapshot = json.load(f)
+	except (OSError, ValueError):
+		return None
+
+	if any(modification_time(file) != time for file, time in snapshot["files"].items()):
+		return None
+	if any(modification_time(directory) != time for directory, time in snapshot["directories"].items()):
+		return None
+
+	projects = {}
+	for path, description in snapshot["projects"].items():
+		project = project_types[description["type"]].__new__(project_types[description["type"]])
+		project.__dict__.update(description["attributes"])
+		projects[path] = project
+	for project in projects.values():
+		project.dependencies = [projects[dep] for dep in project.dependencies]
+
+	CbuildProjects.global_loaded_projects.update(projects)
+	return projects[snapshot["root"]]
+
+
+def load(project_path):
+	project_path = os.path.abspath(project_path)
+	if project_path in CbuildProjects.global_loaded_projects:
+		return CbuildProjects.global_loaded_projects[project_path]
+
+	project = restore(project_path)
+	if project is None:
+		SourceScan.global_listings = SourceScan.DirectoryListings(SourceScan.listings_path(project_path))
+		project = CbuildProjects.load_project(project_path)
+		SourceScan.global_listings.save()
+		save(project)
+	return project
@@ -0,0 +1,80 @@
+import os
+import json
+import threading
+import Cache
+
+
+class DirectoryListings:
+	"""Directory entries of earlier scans, reused while the modification time of the directory is unchanged"""
+
+	def __init__(self, path=None):
+		self.path = path
+		self.listings = {}
+		"""Directory -> [modification time, [[entry name, is directory], ...]]"""
+		self.used = set()
+		self.modified = False
+		self.lock = threading.Lock()
+		if path and os.path.exists(path):
+			try:
+				with open(path) as f:
+					self.listings = json.load(f)
+			except (OSError, ValueError):
+				self.listings = {}
+
+	def list(self, directory) -> (int, list):
+		mtime = os.stat(directory).st_mtime_ns
+		with self.lock:
+			self.used.add(directory)
+			cached = self.listings.get(directory)
+			if cached and cached[0] == mtime:
+				return mtime, cached[1]
+
+		with os.scandir(directory) as entries:
+			listing = [[entry.name, entry.is_dir(follow_symlinks=False)] for entry in entries]
+		with self.lock:
+			self.listings[directory] = [mtime, listing]
+			self.modified = True
+		return mtime, listing
+
+	def save(self):
+		"""Stores the listings of the directories scanned by this process"""
+		if not self.path or not self.modified:
+			return
+		with self.lock:
+			listings = {directory: self.listings[directory] for directory in self.used if directory in self.listings}
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		with open(self.path + ".tmp", "w") as f:
+			json.dump(listings, f)
+		os.replace(self.path + ".tmp", self.path)
+
+
+global_listings = DirectoryListings()
+
+
+def listings_path(project_path) -> str:
+	return os.path.join(Cache.global_cache_dir, "listings", Cache.hash_strings([project_path]) + ".json")
+
+
+def scan(directory, extensions: list, ignored_names: set, ignored_paths: set, recursive: bool = True) -> (dict, dict):
+	"""
+	Walks the directory once and sorts files by extension, skipping hidden directories,
+	directories with ignored names and ignored absolute paths.
+	Returns extension -> found files and scanned directory -> its modification time.
+	"""
+	found = {extension: [] for extension in extensions}
+	scanned = {}
+	stack = [os.path.normpath(directory)]
+	while stack:
+		current = stack.pop()
+		mtime, listing = global_listings.list(current)
+		scanned[current] = mtime
+		for name, is_directory in sorted(listing):
+			path = os.path.join(current, name)
+			if is_directory:
+				if recursive and not name.startswith(".") and name not in ignored_names and path not in ignored_paths:
+					stack.append(path)
+				continue
+			extension = os.path.splitext(name)[1]
+			if extension in found:
+				found[extension].append(path)
+	return {extension: sorted(files) for extension, files in found.items()}, scanned
@@ -1,31 +1,87 @@
 import os
 import json
-import subprocess
+import time
+import shutil
+import Cache
 
 global_toolchains = None
+"""Toolchain name -> tool name -> resolved path, with the unresolved tools listed under 'unresolved'"""
 
+resolution_time = None
+"""Seconds spent resolving tool paths, None until they are needed"""
+resolved_from_cache = False
 
-def is_program_valid(program_name):
+
+def paths_file() -> str:
+	return os.path.join(os.path.dirname(os.path.abspath(__file__)), "paths.json")
+
+
+def cache_file() -> str:
+	return os.path.join(Cache.global_cache_dir, "tools.json")
+
+
+def resolve(toolchains: dict) -> dict:
+	for toolchain in toolchains.values():
+		unresolved = []
+		for tool_name, tool_path in toolchain.items():
+			resolved = shutil.which(tool_path)
+			if resolved is None:
+				unresolved.append(tool_name)
+			else:
+				toolchain[tool_name] = resolved
+		if unresolved:
+			toolchain["unresolved"] = unresolved
+	return toolchains
+
+
+def load_cached(key):
 	try:
-		with open(os.devnull, 'w') as devnull:
-			return subprocess.call(["which", program_name], stdout=devnull, stderr=devnull) == 0
-	except OSError:
-		return False
+		with open(cache_file()) as f:
+			cached = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if cached.get("key") != key:
+		return None
+
+	# tools removed or installed since the last resolution invalidate the cache
+	for toolchain in cached["toolchains"].values():
+		unresolved = toolchain.get("unresolved", [])
+		for tool_name, tool_path in toolchain.items():
+			if tool_name == "unresolved":
+				continue
+			if tool_name in unresolved:
+				if shutil.which(tool_path) is not None:
+					return None
+			elif not os.path.exists(tool_path):
+				return None
+	return cached["toolchains"]
 
 
 def load():
-	global global_toolchains
-	file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "paths.json")
-	with open(file) as f:
-		global_toolchains = json.load(f)
+	"""Resolves tool paths from paths.json, reusing the last resolution while PATH and paths.json are unchanged"""
+	global global_toolchains, resolution_time, resolved_from_cache
+	start_time = time.perf_counter()
 
-	# check if exists
-	for key, toolchain in global_toolchains.items():
-		for tool_name, tool_path in toolchain.items():
-			if not is_program_valid(tool_path):
-				if not ("unresolved" in toolchain):
-					toolchain["unresolved"] = []
-				toolchain["unresolved"].append(tool_name)
+	with open(paths_file()) as f:
+		content = f.read()
+	key = Cache.hash_strings([os.environ.get("PATH", ""), content])
+
+	global_toolchains = load_cached(key)
+	resolved_from_cache = global_toolchains is not None
+	if global_toolchains is None:
+		global_toolchains = resolve(json.loads(content))
+		try:
+			os.makedirs(os.path.dirname(cache_file()), exist_ok=True)
+			with open(cache_file() + ".tmp", "w") as f:
+				json.dump({"key": key, "toolchains": global_toolchains}, f)
+			os.replace(cache_file() + ".tmp", cache_file())
+		except OSError:
+			pass
+
+	resolution_time = time.perf_counter() - start_time
 
 
-load()
+def toolchains() -> dict:
+	if global_toolchains is None:
+		load()
+	return global_toolchains
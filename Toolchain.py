@@ -1,6 +1,11 @@
 import os
 import subprocess
+import threading
 import ToolPathsConfig as ToolPath
+import Cache
+import Jobs
+import Process
+import Trace
 from BuildConfiguration import CompilationProperties
 import Errors
 import platform
@@ -11,15 +16,20 @@ if platform.system() == 'Windows':
 
 	SLIB_EXT = '.dll'
 	EXE_EXT = '.exe'
+	LIBRARY_PATH_VARIABLE = 'PATH'
 elif platform.system() == 'Darwin' or platform.system() == 'Linux':
 	LIB_EXT = '.a'
 	LIB_PREFIX = 'lib'
 
 	SLIB_EXT = '.so'
 	EXE_EXT = ''
+	LIBRARY_PATH_VARIABLE = 'DYLD_LIBRARY_PATH' if platform.system() == 'Darwin' else 'LD_LIBRARY_PATH'
 else:
 	raise OSError('Unsupported operating system')
 
+lto_cache_policy = "cache_size_bytes=1g:prune_interval=1h:prune_after=168h"
+"""ThinLTO cache pruning, the oldest entries go once the cache outgrows a gigabyte or were unused for a week"""
+
 
 def library_name(name) -> str:
 	return LIB_PREFIX + name + LIB_EXT
@@ -30,10 +40,19 @@ def executable_name(name) -> str:
 
 
 def shared_object_name(name) -> str:
-	return name + SLIB_EXT
+	return LIB_PREFIX + name + SLIB_EXT
+
 
+def library_environment(library_directories) -> dict:
+	"""Environment that lets an executable find the shared objects in the directories"""
+	env = dict(os.environ)
+	directories = list(library_directories) + ([env[LIBRARY_PATH_VARIABLE]] if env.get(LIBRARY_PATH_VARIABLE) else [])
+	if directories:
+		env[LIBRARY_PATH_VARIABLE] = os.pathsep.join(directories)
+	return env
 
-class ToolchainError(Exception):
+
+class ToolchainError(Errors.CBuildError):
 	def __init__(self, message):
 		super().__init__(message)
 
@@ -48,37 +67,114 @@ def check_output(output):
 		raise ToolchainError("Build terminated because of compilation errors")
 
 
-def run_command(command: list) -> None:
-	result = subprocess.run(command, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	Errors.log(result.stdout.decode()) if len(result.stdout) > 0 else None
-	Errors.log(result.stderr.decode()) if len(result.stderr) > 0 else None
+def depfile_name(output) -> str:
+	return os.path.splitext(output)[0] + ".d"
+
+
+def time_trace_name(output) -> str:
+	"""Where clang writes the -ftime-trace report of an object"""
+	return os.path.splitext(output)[0] + ".json"
+
+
+def read_depfile(depfile, base_directory) -> list:
+	"""Returns absolute paths of every file listed as a prerequisite in a make-style depfile"""
+	with open(depfile) as f:
+		content = f.read().replace("\\\n", " ").replace("\\\r\n", " ")
+
+	dependencies = []
+	for rule in content.splitlines():
+		_, separator, prerequisites = rule.partition(": ")
+		if not separator:
+			continue
+		for path in prerequisites.replace("\\ ", "\0").split():
+			dependencies.append(os.path.normpath(os.path.join(base_directory, path.replace("\0", " "))))
+	return dependencies
+
+
+def run_command(command: list, stream: bool = False, env=None) -> None:
+	"""
+	Runs a tool and raises if it exits with an error. Output is logged as one block once the tool exits,
+	or written by the tool straight to the console if streamed.
+	"""
+	output = Process.BoundedOutput()
+	try:
+		if stream:
+			code = Process.run(command, None, env=env)
+		else:
+			with Jobs.job_slot() as slot, Trace.span(os.path.basename(command[0]), "process", slot=slot, command=command):
+				code = Process.run(command, output.append)
+	except OSError as error:
+		raise ToolchainError(f"Unable to start '{command[0]}' : {error}")
+
+	text = output.text()
+	Errors.log(text.rstrip("\n")) if len(text) > 0 else None
+	if code != 0:
+		raise ToolchainError(f"'{os.path.basename(command[0])}' failed with exit code {code}")
+
+
+def capture_command(command: list):
+	"""Returns standard output of the command or None if it did not succeed"""
+	output = Process.BoundedOutput(None)
+	try:
+		with Jobs.job_slot() as slot, Trace.span(os.path.basename(command[0]), "process", slot=slot, command=command):
+			code = Process.run(command, output.append, merge_errors=False)
+	except OSError:
+		return None
+	return output.data() if code == 0 else None
 
 
 class Toolchain:
 	def __init__(self):
 		self.name = None
 
-	def check_tools(self):
-		if "unresolved" in ToolPath.global_toolchains[self.name]:
-			raise ToolchainError("Unresolved paths for {name} toolset : " + str(ToolPath.global_toolchains[self.name]["unresolved"]))
+	def check_tools(self, tool_names: list):
+		"""Only the tools a step runs have to be resolved, so optional linkers and debuggers may be missing"""
+		tools = ToolPath.toolchains()[self.name]
+		missing = [tool_name for tool_name in tool_names if tool_name not in tools]
+		if missing:
+			raise ToolchainError(f"Tools {missing} of the {self.name} toolset are not listed in paths.json")
+		unresolved = [tool_name for tool_name in tool_names if tool_name in tools.get("unresolved", [])]
+		if unresolved:
+			raise ToolchainError(f"Unresolved paths for {self.name} toolset : " + str(unresolved))
 
 	def tool_path(self, tool_name):
-		self.check_tools()
-		return ToolPath.global_toolchains[self.name][tool_name]
+		self.check_tools([tool_name])
+		return ToolPath.toolchains()[self.name][tool_name]
+
+	def compile_command(self, source, output, includes, definitions, config, pch=None, position_independent=False) -> list:
+		pass
 
-	def compile_object(self, source, output, includes, definitions, config):
+	def precompile_header_command(self, header, output, includes, definitions, config, position_independent=False) -> list:
 		pass
 
-	def package_objects(self, objects, output, config):
+	def package_command(self, objects, output, config) -> list:
 		pass
 
-	def link_objects(self, objects, output, libraries, library_directories, config):
+	def link_command(self, objects, output, libraries, library_directories, config, runtime_directories=(), shared=False, lto_cache=None) -> list:
 		pass
 
-	def run(self, executable_file):
+	def compile_object(self, source, output, includes, definitions, config, pch=None, position_independent=False):
 		pass
 
-	def debug(self, executable_file):
+	def precompile_header(self, header, output, includes, definitions, config, position_independent=False):
+		pass
+
+	def package_objects(self, objects, output, config, changed=None, removed=None):
+		pass
+
+	def link_objects(self, objects, output, libraries, library_directories, config, runtime_directories=(), shared=False, lto_cache=None):
+		pass
+
+	def exported_symbols(self, shared_object) -> str:
+		pass
+
+	def merge_profiles(self, raw_profiles, output):
+		pass
+
+	def run(self, executable_file, library_directories=(), arguments=()):
+		pass
+
+	def debug(self, executable_file, library_directories=()):
 		pass
 
 
@@ -88,94 +184,275 @@ class LLVMToolchain(Toolchain):
 		super().__init__()
 		self.name = "llvm"
 		self.options_map = {
-				"optimization": {"0": "-O0", "1": "-O1", "2": "-O2", "3": "-O3", "fast": "-Ofast", "size": "-Os"},
+				"optimization": {"0": "-O0", "1": "-O1", "2": "-O2", "3": "-O3", "fast": "-Ofast", "size": "-Os", "speed": "-O3"},
 				"debug": {"True": "-g"},
 				"std": {"11": "-std=c++11", "17": "-std=c++17", "20": "-std=c++20", "latest": "-std=c++20"},
 				"arch": {"intel": "-march=native", "arm": "-march=armv7-a"},
 				"register": {"64": "-m64", "32": "-m32"},
+				"lto": {"thin": "-flto=thin", "full": "-flto=full"},
 		}
+		self.linker_tools = {"lld": "ld.lld", "mold": "mold"}
+		"""Linker option -> tool in paths.json"""
+		self.linker_thread_flags = {"lld": "-Wl,--threads={}", "mold": "-Wl,--thread-count={}"}
+
+		self.identity = None
+		self.identity_lock = threading.Lock()
 
 	def option(self, name: str, config: CompilationProperties) -> str:
 		if getattr(config, name) in self.options_map[name]:
 			return self.options_map[name][getattr(config, name)]
 		return ""
 
-	def compile_object(self, source, output, includes, definitions, config: CompilationProperties):
-		self.check_tools()
-		clear_output(output)
-
-		command = [self.tool_path("clang++"), source, "-c", "-o", output]
+	def option_flags(self, config: CompilationProperties) -> list:
+		flags = [self.option(name, config) for name in ["debug", "optimization", "std", "arch", "register", "lto"]]
+		return [flag for flag in flags if flag] + self.debug_flags(config) + self.profile_flags(config)
+
+	def debug_flags(self, config: CompilationProperties) -> list:
+		"""Shrink the debug information the linker has to process, passed to the compiler and the linker alike"""
+		if config.debug != "True":
+			return []
+		flags = []
+		if config.split_dwarf == "True":
+			flags.append("-gsplit-dwarf")
+		if config.gdb_index == "True":
+			# the linker builds the index from the public names
+			flags.append("-ggnu-pubnames")
+		if config.compress_debug_sections == "True":
+			flags.append("-gz")
+		return flags
+
+	def profile_flags(self, config: CompilationProperties) -> list:
+		"""Instrumentation writing raw profiles or optimization with a merged profile, passed to the compiler and the linker alike"""
+		if config.profile_generate:
+			return ["-fprofile-generate=" + config.profile_generate]
+		if config.profile_use:
+			return ["-fprofile-use=" + config.profile_use]
+		return []
+
+	def linker_tool(self, config: CompilationProperties):
+		return self.linker_tools.get(config.linker)
+
+	def link_flags(self, config: CompilationProperties) -> list:
+		if config.linker == "default":
+			# gdb_index is ignored without debug information, like wherever else it is applied
+			if (config.gdb_index == "True" and config.debug == "True") or config.link_threads != "default":
+				raise ToolchainError("Options gdb_index and link_threads need the lld or mold linker")
+			return []
+
+		flags = ["--ld-path=" + self.tool_path(self.linker_tool(config))]
+		if config.link_threads != "default":
+			flags.append(self.linker_thread_flags[config.linker].format(config.link_threads))
+		if config.gdb_index == "True" and config.debug == "True":
+			flags.append("-Wl,--gdb-index")
+		return flags
+
+	def lto_cache_flags(self, config: CompilationProperties, lto_cache) -> list:
+		"""
+		Lets ThinLTO reuse the code generated for unchanged modules between links.
+		lld takes the cache options itself, the other linkers through the llvm plugin.
+		"""
+		if config.lto != "thin" or not lto_cache:
+			return []
+		if config.linker == "lld":
+			return ["-Wl,--thinlto-cache-dir=" + lto_cache, "-Wl,--thinlto-cache-policy=" + lto_cache_policy]
+		return ["-Wl,-plugin-opt,cache-dir=" + lto_cache, "-Wl,-plugin-opt,cache-policy=" + lto_cache_policy]
+
+	def cacheable(self, config: CompilationProperties) -> bool:
+		"""
+		Objects compiled with a time trace or split dwarf come with files next to them the object cache does not hold,
+		so they are always compiled.
+		"""
+		return config.time_trace != "True" and not (config.debug == "True" and config.split_dwarf == "True")
+
+	def compile_flags(self, includes, definitions, config: CompilationProperties, pch=None, position_independent=False) -> list:
+		flags = ["-include-pch", pch] if pch else []
+		if position_independent:
+			flags.append("-fPIC")
 		for include in includes:
-			command.append("-I")
-			command.append(include)
+			flags.append("-I")
+			flags.append(include)
 		for define in definitions:
-			command.append("-D")
-			command.append(define)
-		command.append(self.option("debug", config))
-		command.append(self.option("optimization", config))
-		command.append(self.option("std", config))
-		command.append(self.option("arch", config))
-		command.append(self.option("register", config))
-
-		if not os.path.exists(os.path.dirname(output)):
-			os.makedirs(os.path.dirname(output))
-
-		run_command(command)
-		check_output(output)
-
-	def package_objects(self, objects, output, config: CompilationProperties):
-		self.check_tools()
-		clear_output(output)
-
-		command = [self.tool_path("llvm-ar"), "rcs", output]
-		command.extend(objects)
-
-		if not os.path.exists(os.path.dirname(output)):
-			os.makedirs(os.path.dirname(output))
-
-		run_command(command)
-		check_output(output)
-
-	def link_objects(self, objects, output, libraries, library_directories, config: CompilationProperties):
-		clear_output(output)
-		self.check_tools()
-
+			flags.append("-D")
+			flags.append(define)
+		return flags + self.option_flags(config) + list(config.additional_compile)
+
+	def compiler_identity(self) -> str:
+		with self.identity_lock:
+			if self.identity is None:
+				compiler = self.tool_path("clang++")
+				version = capture_command([compiler, "--version"]) or b""
+				self.identity = compiler + "\n" + version.decode()
+		return self.identity
+
+	def object_cache_key(self, source, output, flags, definitions, config: CompilationProperties, pch=None):
+		"""
+		Preprocesses the source, writing its depfile on the way, and hashes the result together with the flags.
+		Returns None when the source can not be preprocessed, the compiler reports the reason then.
+		"""
+		command = [self.tool_path("clang++"), source, "-E", "-o", "-", "-MD", "-MF", depfile_name(output), "-MT", output]
+		if config.debug != "True":
+			# without debug information code moving to other lines builds the same object
+			command.insert(3, "-P")
+		preprocessed = capture_command(command + flags)
+		if preprocessed is None:
+			return None
+
+		key = [self.compiler_identity(), preprocessed] + self.option_flags(config) + list(config.additional_compile) + list(definitions)
+		if config.debug == "True":
+			# debug information refers to the source location
+			key.append(os.path.abspath(source))
+		if pch:
+			# declarations coming from the precompiled header are not part of the preprocessed source
+			key.append(Cache.file_digest(pch))
+		if "-fPIC" in flags:
+			key.append("-fPIC")
+		if config.profile_use:
+			key.append(Cache.file_digest(config.profile_use))
+		return Cache.hash_strings(key)
+
+	def compile_command(self, source, output, includes, definitions, config: CompilationProperties, pch=None, position_independent=False) -> list:
+		command = [self.tool_path("clang++"), source, "-c", "-o", output, "-MD", "-MF", depfile_name(output)]
+		if config.time_trace == "True":
+			command.append("-ftime-trace")
+		return command + self.compile_flags(includes, definitions, config, pch, position_independent)
+
+	def precompile_header_command(self, header, output, includes, definitions, config: CompilationProperties, position_independent=False) -> list:
+		command = [self.tool_path("clang++"), "-x", "c++-header", header, "-o", output, "-MD", "-MF", depfile_name(output)]
+		return command + self.compile_flags(includes, definitions, config, position_independent=position_independent)
+
+	def package_command(self, objects, output, config: CompilationProperties) -> list:
+		operation = "rcsT" if config.thin_archives == "True" else "rcs"
+		return [self.tool_path("llvm-ar"), operation, output] + list(objects)
+
+	def link_command(self, objects, output, libraries, library_directories, config: CompilationProperties, runtime_directories=(), shared=False, lto_cache=None) -> list:
 		command = [self.tool_path("clang++")]
+		if shared:
+			if platform.system() == 'Darwin':
+				# ld64 has no soname, the install name lets dependents find the library through their rpaths
+				command.extend(["-shared", "-Wl,-install_name,@rpath/" + os.path.basename(output)])
+			else:
+				command.extend(["-shared", "-Wl,-soname," + os.path.basename(output)])
 		command.extend(objects)
 		for library_directory in library_directories:
 			command.append("-L" + library_directory)
 		for library in libraries:
 
-			if library.startswith("lib") and library.endswith(".a"):
-				library_striped = library[len("lib"):-len(".a")]
+			if library.startswith("lib") and library.endswith((LIB_EXT, SLIB_EXT)):
+				library_striped = os.path.splitext(library)[0][len("lib"):]
 			else:
 				library_striped = library
 
 			command.append("-l" + library_striped)
 
+		if platform.system() != 'Windows':
+			# shared objects of dependencies are found next to where they were built
+			for runtime_directory in runtime_directories:
+				command.append("-Wl,-rpath," + runtime_directory)
+
 		command.append("-o")
 		command.append(output)
-		command.append(self.option("debug", config))
-		command.append(self.option("optimization", config))
-		command.append(self.option("std", config))
-		command.append(self.option("arch", config))
-		command.append(self.option("register", config))
+		return command + self.option_flags(config) + self.link_flags(config) + self.lto_cache_flags(config, lto_cache) + list(config.additional_link)
+
+	def compile_object(self, source, output, includes, definitions, config: CompilationProperties, pch=None, position_independent=False):
+		self.check_tools(["clang++"])
+		clear_output(output)
 
 		if not os.path.exists(os.path.dirname(output)):
-			os.makedirs(os.path.dirname(output))
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+
+		flags = self.compile_flags(includes, definitions, config, pch, position_independent)
+
+		with Trace.span(f"compile {os.path.basename(source)}", "compile", source=source, output=output) as trace_args:
+			cache = Cache.global_object_cache
+			use_cache = cache.enabled() and self.cacheable(config)
+			key = self.object_cache_key(source, output, flags, definitions, config, pch) if use_cache else None
+			if key and cache.fetch(key, output):
+				trace_args["cache"] = "hit"
+				return
+			trace_args["cache"] = "miss" if key else "off"
 
-		run_command(command)
-		check_output(output)
+			run_command(self.compile_command(source, output, includes, definitions, config, pch, position_independent))
+			check_output(output)
 
-	def run(self, executable_file):
-		self.check_tools()
+			if key:
+				cache.store(key, output)
+
+	def precompile_header(self, header, output, includes, definitions, config: CompilationProperties, position_independent=False):
+		self.check_tools(["clang++"])
+		clear_output(output)
+
+		if not os.path.exists(os.path.dirname(output)):
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+
+		with Trace.span(f"precompile {os.path.basename(header)}", "precompile", header=header, output=output):
+			run_command(self.precompile_header_command(header, output, includes, definitions, config, position_independent))
+			check_output(output)
+
+	def package_objects(self, objects, output, config: CompilationProperties, changed=None, removed=None):
+		"""
+		Archives the objects. Given the changed and removed objects since the archive was written, only those members
+		are replaced and deleted in place. Regular archives name their members by file name, so objects sharing a name
+		and thin archives, which only reference their members, are always written from scratch.
+		"""
+		self.check_tools(["llvm-ar"])
+		names = [os.path.basename(obj) for obj in list(objects) + list(removed or [])]
+		update = changed is not None and os.path.exists(output) and config.thin_archives != "True" and len(set(names)) == len(names)
+		if not update:
+			clear_output(output)
+
+		if not os.path.exists(os.path.dirname(output)):
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+
+		with Trace.span(f"package {os.path.basename(output)}", "package", output=output, objects=len(objects)) as trace_args:
+			if update:
+				trace_args["replaced"] = len(changed)
+				if removed:
+					run_command([self.tool_path("llvm-ar"), "ds", output] + [os.path.basename(obj) for obj in removed])
+				if changed:
+					run_command(self.package_command(changed, output, config))
+			else:
+				run_command(self.package_command(objects, output, config))
+			check_output(output)
+
+	def link_objects(self, objects, output, libraries, library_directories, config: CompilationProperties, runtime_directories=(), shared=False, lto_cache=None):
+		clear_output(output)
+		self.check_tools(["clang++"] + ([self.linker_tool(config)] if self.linker_tool(config) else []))
+
+		if not os.path.exists(os.path.dirname(output)):
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+		if config.lto == "thin" and lto_cache:
+			os.makedirs(lto_cache, exist_ok=True)
+
+		with Trace.span(f"link {os.path.basename(output)}", "link", output=output, objects=len(objects), libraries=libraries, linker=config.linker, lto=config.lto):
+			run_command(self.link_command(objects, output, libraries, library_directories, config, runtime_directories, shared, lto_cache))
+			check_output(output)
+
+	def exported_symbols(self, shared_object) -> str:
+		"""Names and kinds of the symbols a shared object defines, without addresses that move with every change"""
+		listing = capture_command([self.tool_path("llvm-nm"), "-D", "--defined-only", "-P", shared_object])
+		if listing is None:
+			raise ToolchainError(f"Unable to list the symbols of '{shared_object}'")
+		symbols = sorted(" ".join(line.split()[:2]) for line in listing.decode(errors="replace").splitlines() if line.strip())
+		return "\n".join(symbols) + "\n"
+
+	def merge_profiles(self, raw_profiles, output):
+		"""Merges raw profiles, the previous profile is kept if they can not be merged"""
+		merged = output + ".tmp"
+		try:
+			run_command([self.tool_path("llvm-profdata"), "merge", "-o", merged] + list(raw_profiles))
+			check_output(merged)
+		except ToolchainError as error:
+			clear_output(merged)
+			raise ToolchainError(f"Unable to merge the training profiles, they may come from a different compiler version : {error}")
+		os.replace(merged, output)
+
+	def run(self, executable_file, library_directories=(), arguments=()):
 		check_output(executable_file)
-		run_command([executable_file])
+		run_command([executable_file] + list(arguments), stream=True, env=library_environment(library_directories))
 
-	def debug(self, executable_file):
-		self.check_tools()
+	def debug(self, executable_file, library_directories=()):
 		cmd = [self.tool_path("lldb"), executable_file]
-		subprocess.call(['gnome-terminal', '--', 'bash', '-c', ' '.join(cmd) + '; exec bash'])
+		subprocess.call(['gnome-terminal', '--', 'bash', '-c', ' '.join(cmd) + '; exec bash'], env=library_environment(library_directories))
 
 
 global_toolchains = [LLVMToolchain()]
@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import Errors
+
+global_events = None
+"""Finished trace events in chrome trace format, None while tracing is disabled"""
+global_events_lock = threading.Lock()
+global_start = time.perf_counter()
+thread_names = {}
+"""Thread id -> name of every thread that recorded an event"""
+
+
+def enable():
+	global global_events
+	global_events = []
+
+
+def enabled() -> bool:
+	return global_events is not None
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args):
+	"""Records the enclosed block as one complete event, the yielded arguments can still be extended inside the block"""
+	if global_events is None:
+		yield args
+		return
+
+	start_time = time.perf_counter()
+	try:
+		yield args
+	finally:
+		end_time = time.perf_counter()
+		thread = threading.current_thread()
+		event = {
+			"name": name,
+			"cat": category,
+			"ph": "X",
+			"ts": (start_time - global_start) * 1e6,
+			"dur": (end_time - start_time) * 1e6,
+			"pid": os.getpid(),
+			"tid": thread.ident,
+			"args": args,
+		}
+		with global_events_lock:
+			thread_names[thread.ident] = thread.name
+			global_events.append(event)
+
+
+def save(path):
+	metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "cbuild"}}]
+	for thread_id, thread_name in thread_names.items():
+		metadata.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": thread_name}})
+
+	with open(path, "w") as f:
+		json.dump({"traceEvents": metadata + global_events, "displayTimeUnit": "ms"}, f)
+
+
+def report_summary(slowest_count: int = 10):
+	"""Logs the slowest translation units and the time every project took"""
+	compiles = sorted((event for event in global_events if event["cat"] == "compile"), key=lambda event: event["dur"], reverse=True)
+	if compiles:
+		Errors.log("Slowest translation units:", 0)
+		for event in compiles[:slowest_count]:
+			cache = f" (cache {event['args']['cache']})" if "cache" in event["args"] else ""
+			Errors.log(f"\t{event['dur'] / 1000:10.1f} ms  {event['args']['source']}{cache}", 0)
+
+	projects = [event for event in global_events if event["cat"] == "project"]
+	if projects:
+		Errors.log("Time per project:", 0)
+		for event in sorted(projects, key=lambda event: event["dur"], reverse=True):
+			Errors.log(f"\t{event['dur'] / 1000:10.1f} ms  {event['name']}", 0)
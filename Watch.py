@@ -0,0 +1,182 @@
+import os
+import time
+import ctypes
+import select
+import struct
+import platform
+import Errors
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+watch_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+structure_mask = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+"""Events that add or remove directory entries and therefore change the project file lists"""
+
+event_header = struct.Struct("iIII")
+
+debounce_time = 0.1
+"""Seconds to keep collecting events after the first one so that a save of several files triggers one build"""
+source_extensions = {".cpp", ".hpp", ".h"}
+"""Files that become part of a project when they are created in one of its directories"""
+
+
+def ignored_name(name) -> bool:
+	"""Editor swap and backup files"""
+	return name.startswith(".") or name.endswith("~") or name.endswith(".swp") or name.endswith(".tmp")
+
+
+class Changes:
+	def __init__(self):
+		self.files = set()
+		self.structure_changed = False
+
+
+class RelevantFiles:
+	"""
+	Files whose changes need a build: project files, the configuration, known sources and headers and new files with
+	source extensions. Anything else, like files the running application writes, is ignored.
+	"""
+
+	def __init__(self, projects, extra_files=()):
+		self.known = set(extra_files)
+		self.outputs = set()
+		for project in projects:
+			self.known.add(project.project_path)
+			self.known.update(project.absolute_path(file) for file in list(project.sources) + list(project.headers))
+			self.outputs.update(project.output_paths())
+
+	def __call__(self, path) -> bool:
+		if path in self.known:
+			return True
+		if os.path.splitext(path)[1] not in source_extensions:
+			return False
+		return not any(path == output or path.startswith(output + os.sep) for output in self.outputs)
+
+
+class InotifyWatcher:
+	"""Waits for changes in a set of directories through inotify"""
+
+	def __init__(self):
+		self.libc = ctypes.CDLL("libc.so.6", use_errno=True)
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		self.directories = {}
+		"""Watch descriptor -> directory"""
+		self.relevant = lambda path: True
+
+	def watch(self, directories, relevant=None):
+		if relevant is not None:
+			self.relevant = relevant
+		watched = set(self.directories.values())
+		for directory in directories:
+			if directory in watched:
+				continue
+			descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), watch_mask)
+			if descriptor < 0:
+				Errors.warn(f"Unable to watch '{directory}' : {os.strerror(ctypes.get_errno())}")
+				continue
+			self.directories[descriptor] = directory
+
+	def read_events(self, changes: Changes):
+		try:
+			data = os.read(self.fd, 64 * 1024)
+		except BlockingIOError:
+			return
+		offset = 0
+		while offset + event_header.size <= len(data):
+			descriptor, mask, _, length = event_header.unpack_from(data, offset)
+			offset += event_header.size
+			name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+			offset += length
+			if descriptor not in self.directories or (name and ignored_name(name)):
+				continue
+			path = os.path.join(self.directories[descriptor], name)
+			if not self.relevant(path):
+				continue
+			changes.files.add(path)
+			if mask & structure_mask:
+				changes.structure_changed = True
+
+	def wait(self) -> Changes:
+		changes = Changes()
+		while not changes.files:
+			select.select([self.fd], [], [])
+			self.read_events(changes)
+		while select.select([self.fd], [], [], debounce_time)[0]:
+			self.read_events(changes)
+		return changes
+
+	def close(self):
+		os.close(self.fd)
+
+
+class PollingWatcher:
+	"""Fallback watcher comparing directory contents and file signatures periodically"""
+
+	def __init__(self, interval: float = 0.5):
+		self.interval = interval
+		self.directories = set()
+		self.signatures = {}
+		self.relevant = lambda path: True
+
+	def watch(self, directories, relevant=None):
+		if relevant is not None:
+			self.relevant = relevant
+		self.directories.update(directories)
+		self.signatures = self.snapshot()
+
+	def snapshot(self) -> dict:
+		signatures = {}
+		for directory in self.directories:
+			try:
+				with os.scandir(directory) as entries:
+					for entry in entries:
+						if entry.is_file() and not ignored_name(entry.name) and self.relevant(entry.path):
+							stat = entry.stat()
+							signatures[entry.path] = (stat.st_mtime_ns, stat.st_size)
+			except OSError:
+				continue
+		return signatures
+
+	def wait(self) -> Changes:
+		changes = Changes()
+		while not changes.files:
+			time.sleep(self.interval)
+			current = self.snapshot()
+			changes.files = {path for path in current.keys() | self.signatures.keys() if current.get(path) != self.signatures.get(path)}
+			changes.structure_changed = current.keys() != self.signatures.keys()
+			self.signatures = current
+		return changes
+
+	def close(self):
+		pass
+
+
+def create_watcher():
+	if platform.system() == "Linux":
+		try:
+			return InotifyWatcher()
+		except (OSError, AttributeError) as error:
+			Errors.warn(f"inotify is not available, falling back to polling : {error}")
+	return PollingWatcher()
+
+
+def watched_directories(projects) -> set:
+	"""Directories holding project files, sources and headers of the given projects"""
+	directories = set()
+	for project in projects:
+		directories.add(project.project_dir)
+		directories.update(project.scanned_directories)
+		for file in list(project.sources) + list(project.headers):
+			directories.add(os.path.dirname(project.absolute_path(file)))
+	return {directory for directory in directories if os.path.isdir(directory)}
@@ -0,0 +1,311 @@
+"""
+Measures the overhead of cbuild itself on generated project graphs.
+
+	python3 benchmark.py [--projects N] [--sources N] [--headers N] [--depth N] [--fan-in N]
+	                     [--repeat N] [--output results.json] [--compare previous.json]
+
+Every build runs in a fresh process like a real invocation, compiling with a stub toolchain
+that writes objects, depfiles, archives and executables itself instead of invoking clang.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+cbuild_dir = os.path.dirname(os.path.abspath(__file__))
+
+benchmark_config = {
+	"toolchain": "stub",
+	"std": "latest",
+	"arch": "intel",
+	"register": "64",
+	"debug": "False",
+	"optimization": "2",
+	"additional_compile": [],
+	"additional_link": [],
+}
+
+
+def register_stub_toolchain():
+	import Toolchain
+	import BuildConfiguration
+
+	class StubToolchain(Toolchain.LLVMToolchain):
+		"""Builds the llvm command lines, so staleness checks stay realistic, but writes every output itself"""
+
+		def __init__(self):
+			super().__init__()
+			self.name = "stub"
+
+		def check_tools(self, tool_names):
+			pass
+
+		def tool_path(self, tool_name):
+			return tool_name
+
+		@staticmethod
+		def included_files(source, includes) -> list:
+			"""Follows quoted includes through the include directories like the preprocessor would"""
+			found = []
+			pending = [source]
+			while pending:
+				with open(pending.pop()) as f:
+					lines = [line for line in f if line.startswith("#include \"")]
+				for line in lines:
+					name = line.split("\"")[1]
+					for directory in includes:
+						path = os.path.join(directory, name)
+						if os.path.exists(path):
+							if path not in found:
+								found.append(path)
+								pending.append(path)
+							break
+			return found
+
+		@staticmethod
+		def write_output(output, content: str, prerequisites=None):
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+			with open(output, "w") as f:
+				f.write(content)
+			if prerequisites is not None:
+				with open(Toolchain.depfile_name(output), "w") as f:
+					f.write(output + ": " + " ".join(path.replace(" ", "\\ ") for path in prerequisites) + "\n")
+
+		@staticmethod
+		def member_contents(objects) -> str:
+			"""Concatenated members, so outputs change whenever one of their objects does"""
+			contents = []
+			for path in objects:
+				with open(path) as f:
+					contents.append(f.read())
+			return "\n".join(contents)
+
+		def compile_object(self, source, output, includes, definitions, config, pch=None, position_independent=False):
+			with open(source) as f:
+				content = f.read()
+			self.write_output(output, content, [source] + self.included_files(source, includes))
+
+		def precompile_header(self, header, output, includes, definitions, config, position_independent=False):
+			self.write_output(output, header, [header] + self.included_files(header, includes))
+
+		def package_objects(self, objects, output, config, changed=None, removed=None):
+			self.write_output(output, self.member_contents(objects))
+
+		def link_objects(self, objects, output, libraries, library_directories, config, runtime_directories=(), shared=False, lto_cache=None):
+			self.write_output(output, self.member_contents(objects) + "\n" + "\n".join(libraries))
+
+		def exported_symbols(self, shared_object) -> str:
+			with open(shared_object) as f:
+				return f.read()
+
+		def run(self, executable_file, library_directories=(), arguments=()):
+			pass
+
+		def debug(self, executable_file, library_directories=()):
+			pass
+
+	if "stub" not in BuildConfiguration.CompilationProperties.interface["toolchain"]:
+		BuildConfiguration.CompilationProperties.interface["toolchain"].append("stub")
+		Toolchain.global_toolchains.append(StubToolchain())
+
+
+def worker(cache_dir, cbuild_args):
+	"""Runs one cbuild command in this process with the stub toolchain available"""
+	import Cache
+	import cbuild
+
+	Cache.global_cache_dir = cache_dir
+	load_config = cbuild.get_config
+
+	def get_config(args):
+		# registered on first use, so an up to date build does not import the toolchain
+		register_stub_toolchain()
+		return load_config(args)
+
+	cbuild.get_config = get_config
+	# leave the executable link of the cbuild directory alone
+	cbuild.link_executable = lambda executable: None
+	sys.argv = [os.path.join(cbuild_dir, "cbuild.py")] + cbuild_args
+	cbuild.main()
+
+
+class Graph:
+	"""Library projects in layers, every layer depending on the one below it, plus one application on top"""
+
+	def __init__(self, root, projects, sources, headers, depth, fan_in, seed=0):
+		self.root = root
+		self.sources = sources
+		self.headers = headers
+		random.seed(seed)
+
+		depth = max(1, min(depth, projects))
+		self.layers = [[] for _ in range(depth)]
+		for index in range(projects):
+			self.layers[index * depth // projects].append(f"Lib{index}")
+
+		self.dependencies = {}
+		for level, layer in enumerate(self.layers):
+			for name in layer:
+				below = self.layers[level - 1] if level > 0 else []
+				self.dependencies[name] = sorted(random.sample(below, min(fan_in, len(below))))
+		self.dependencies["App"] = list(self.layers[-1])
+
+	def project_file(self, name) -> str:
+		return os.path.join(self.root, name, name + ".py")
+
+	def header(self, name, index) -> str:
+		return os.path.join(self.root, name, "public", name, f"Header{index}.hpp")
+
+	def source(self, name, index) -> str:
+		return os.path.join(self.root, name, "private", f"Source{index}.cpp")
+
+	def write_project(self, name, project_type):
+		with open(os.path.join(cbuild_dir, "cproj.py")) as f:
+			template = f.read()
+		content = template.format(project_type, name)
+		dependencies = ", ".join(f"\"../{dep}/{dep}\"" for dep in self.dependencies[name])
+		content = content.replace(f"self.name = \"{name}\"\n", f"self.name = \"{name}\"\n\t\tself.dependencies = [{dependencies}]\n")
+		os.makedirs(os.path.dirname(self.project_file(name)), exist_ok=True)
+		with open(self.project_file(name), "w") as f:
+			f.write(content)
+
+	def write_file(self, path, lines):
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, "w") as f:
+			f.write("\n".join(lines) + "\n")
+
+	def generate(self):
+		for layer in self.layers:
+			for name in layer:
+				self.write_project(name, "LibraryProject")
+				for index in range(self.headers):
+					includes = [f"#include \"{dep}/Header0.hpp\"" for dep in self.dependencies[name]] if index == 0 else [f"#include \"{name}/Header0.hpp\""]
+					self.write_file(self.header(name, index), ["#pragma once"] + includes + [f"int {name}_function{index}();"])
+				for index in range(self.sources):
+					includes = [f"#include \"{name}/Header{header}.hpp\"" for header in range(index % max(1, self.headers), self.headers)]
+					self.write_file(self.source(name, index), includes + [f"int {name}_source{index}() {{ return {index}; }}"])
+
+		self.write_project("App", "BinaryProject")
+		includes = [f"#include \"{dep}/Header0.hpp\"" for dep in self.dependencies["App"]]
+		self.write_file(os.path.join(self.root, "App", "private", "Main.cpp"), includes + ["int main() { return 0; }"])
+		with open(os.path.join(self.root, "App", "Benchmark.json"), "w") as f:
+			json.dump(benchmark_config, f, indent=2)
+
+	def file_count(self) -> int:
+		return sum(len(layer) for layer in self.layers) * (self.sources + self.headers) + 1
+
+
+def measure(cache_dir, cbuild_args) -> (float, float):
+	"""Returns wall seconds and peak resident megabytes of one cbuild process"""
+	command = [sys.executable, os.path.abspath(__file__), "--worker", cache_dir] + cbuild_args
+	start_time = time.perf_counter()
+	process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	output = process.stdout.read()
+	_, status, usage = os.wait4(process.pid, 0)
+	elapsed = time.perf_counter() - start_time
+	process.returncode = os.waitstatus_to_exitcode(status)
+	if process.returncode != 0:
+		raise RuntimeError(f"cbuild {' '.join(cbuild_args)} failed :\n{output.decode(errors='replace')}")
+	# kilobytes on linux, bytes on macos
+	peak = usage.ru_maxrss / (1 << 20) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+	return elapsed, peak
+
+
+def touch_edit(path, revision):
+	with open(path, "a") as f:
+		f.write(f"// edit {revision}\n")
+
+
+def run_benchmark(arguments) -> dict:
+	root = tempfile.mkdtemp(prefix="cbuild-benchmark-")
+	try:
+		graph = Graph(os.path.join(root, "projects"), arguments.projects, arguments.sources, arguments.headers, arguments.depth, arguments.fan_in)
+		graph.generate()
+		cache_dir = os.path.join(root, "cache")
+		build = ["compile", "-j", str(arguments.jobs), graph.project_file("App"), "Benchmark"]
+
+		results = {}
+		peaks = {}
+
+		def scenario(name, prepare=None):
+			times = []
+			peak = 0
+			for revision in range(1 if name == "cold" else arguments.repeat):
+				if prepare:
+					prepare(revision)
+				elapsed, rss = measure(cache_dir, build)
+				times.append(elapsed)
+				peak = max(peak, rss)
+			results[name] = {"median_s": statistics.median(times), "min_s": min(times), "max_s": max(times)}
+			peaks[name] = peak
+
+		bottom = graph.layers[0][0]
+		scenario("cold")
+		scenario("noop")
+		scenario("source_edit", lambda revision: touch_edit(graph.source(bottom, 0), revision))
+		scenario("header_edit", lambda revision: touch_edit(graph.header(bottom, graph.headers - 1), revision))
+
+		return {
+			"parameters": {name: getattr(arguments, name) for name in ["projects", "sources", "headers", "depth", "fan_in", "repeat", "jobs"]},
+			"files": graph.file_count(),
+			"commit": git_revision(),
+			"python": sys.version.split()[0],
+			"results": results,
+			"peak_rss_mb": peaks,
+		}
+	finally:
+		shutil.rmtree(root, ignore_errors=True)
+
+
+def git_revision():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cbuild_dir, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(current: dict, previous: dict):
+	print(f"{'scenario':<16}{'previous':>12}{'current':>12}{'change':>10}")
+	for name, result in current["results"].items():
+		if name not in previous.get("results", {}):
+			continue
+		before = previous["results"][name]["median_s"]
+		after = result["median_s"]
+		print(f"{name:<16}{before * 1000:10.1f}ms{after * 1000:10.1f}ms{(after / before - 1) * 100 if before else 0:+9.1f}%")
+
+
+def main():
+	if len(sys.argv) > 2 and sys.argv[1] == "--worker":
+		worker(sys.argv[2], sys.argv[3:])
+		return
+
+	parser = argparse.ArgumentParser(description="Measures cbuild overhead on a generated project graph")
+	parser.add_argument("--projects", type=int, default=20, help="library projects in the graph")
+	parser.add_argument("--sources", type=int, default=20, help="sources per library")
+	parser.add_argument("--headers", type=int, default=10, help="public headers per library")
+	parser.add_argument("--depth", type=int, default=4, help="layers of libraries depending on the layer below")
+	parser.add_argument("--fan-in", type=int, default=2, help="libraries of the layer below every library depends on")
+	parser.add_argument("--repeat", type=int, default=5, help="runs of every incremental scenario")
+	parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="parallel build jobs")
+	parser.add_argument("--output", help="file the json results are written to")
+	parser.add_argument("--compare", help="json results of an earlier run to compare against")
+	arguments = parser.parse_args()
+
+	results = run_benchmark(arguments)
+	print(json.dumps(results, indent=2))
+	if arguments.output:
+		with open(arguments.output, "w") as f:
+			json.dump(results, f, indent=2)
+	if arguments.compare:
+		with open(arguments.compare) as f:
+			compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+	main()
@@ -1,12 +1,42 @@
 import os
 import sys
-import importlib.util
-import CbuildProjects
-import shutil
-import BuildConfiguration
-import Errors
-import Toolchain
+import time
 import json
+import importlib
+import Errors
+import Trace
+
+global_timings = None
+"""Startup phase -> seconds, collected when --timings is given"""
+
+global_context = {}
+"""Contents of CBuildContext.json"""
+
+project_types = {"binary": "BinaryProject", "library": "LibraryProject"}
+"""Project type argument of init -> project class written to the new project file"""
+
+
+def timed(phase, function, *args):
+	start_time = time.perf_counter()
+	try:
+		with Trace.span(phase, "cbuild"):
+			return function(*args)
+	finally:
+		if global_timings is not None:
+			global_timings.append((phase, time.perf_counter() - start_time))
+
+
+def import_module(name):
+	"""Imports build modules on first use, so that every command only loads what it needs"""
+	if name in sys.modules:
+		return sys.modules[name]
+	return timed(f"import {name}", importlib.import_module, name)
+
+
+def configure_caches():
+	Cache = import_module("Cache")
+	Cache.global_cache_dir = global_context.get("cache_directory", Cache.global_cache_dir)
+	Cache.global_object_cache.size_limit_mb = int(global_context.get("object_cache_size", Cache.global_object_cache.size_limit_mb))
 
 
 def load_project(project_path):
@@ -16,18 +46,9 @@ def load_project(project_path):
 	if not os.path.exists(project_path):
 		raise Errors.CBuildError(f"No such project file {project_path}")
 
-	# load module
-	spec = importlib.util.spec_from_file_location(project_path, project_path)
-	module = importlib.util.module_from_spec(spec)
-	# pass arguments to the module
-	module.cbuild = CbuildProjects
-	CbuildProjects.global_project_path = os.path.abspath(project_path)
-	# execute module
-	spec.loader.exec_module(module)
-	# initialize project
-	project = module.Project()
-	project.load_dependencies(CbuildProjects)
-	return project
+	configure_caches()
+	ProjectCache = import_module("ProjectCache")
+	return timed("load project", ProjectCache.load, project_path)
 
 
 def init_cmd(args):
@@ -35,6 +56,9 @@ def init_cmd(args):
 	project_path = os.path.join(os.path.abspath(args["directory"]), args["name"] + ".py")
 	directory = os.path.dirname(os.path.abspath(project_path))
 
+	if args["type"] not in project_types:
+		raise Errors.CBuildError(f"Unknown project type '{args['type']}', expected one of {', '.join(project_types)}")
+
 	if os.path.exists(project_path):
 		raise Errors.CBuildError("Project file already exists")
 
@@ -43,11 +67,11 @@ def init_cmd(args):
 
 	with open(project_path, "w") as f:
 		# Write the initial code to the file
-		project_type = getattr(CbuildProjects, args["type"].capitalize() + "Project")
 		project_sample_source = open(os.path.join(current_file_dir, 'cproj.py'), 'r').read()
-		f.write(project_sample_source.format(project_type.__name__, args["name"]))
+		f.write(project_sample_source.format(project_types[args["type"]], args["name"]))
 
 	if args["add-files"] != "False":
+		shutil = import_module("shutil")
 		if args["type"] == "binary":
 			out_dir = os.path.join(directory, "private")
 			if not os.path.exists(out_dir):
@@ -68,55 +92,228 @@ def init_cmd(args):
 			shutil.copy(os.path.join(current_file_dir, "Library.hpp"), header_path)
 
 
-def get_config(args):
+def load_config(args):
 	directory = os.path.dirname(args["project-path"])
-	config = BuildConfiguration.CompilationProperties()
+	config = import_module("BuildConfiguration").CompilationProperties()
 	user_config = os.path.join(directory, args["cfg"] + ".json")
 
 	if os.path.exists(user_config):
 		config.load(directory, args["cfg"])
 	else:
 		config.load(os.path.dirname(os.path.abspath(__file__)), args["cfg"])
+	return config
+
+
+def get_config(args):
+	config = load_config(args)
+	if config.use_profile == "True":
+		profile = import_module("BuildStamp").profile_file(os.path.abspath(args["project-path"]), args["cfg"])
+		if os.path.exists(profile):
+			Errors.log(f"Optimizing with profile {profile}", 1)
+			config.profile_use = profile
+		else:
+			Errors.warn(f"Option use_profile is set but there is no profile at '{profile}', run the pgo command first")
 
 	return config
 
 
-def compile_cmd(args):
-	config = get_config(args)
-	project = load_project(args["project-path"])
-	project.compile(config)
+def config_names(args) -> list:
+	"""Names of a comma separated list of configurations, like Debug,Release"""
+	names = list(dict.fromkeys(name.strip() for name in args["cfg"].split(",") if name.strip()))
+	if not names:
+		raise Errors.CBuildError("No configuration given")
+	return names
 
-	if project.project_type() == "application":
-		link_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ExecutableLink")
-		if os.path.exists(link_path):
-			os.remove(link_path)
-		os.symlink(project.output_file(config), link_path)
+
+def get_configs(args) -> list:
+	return [get_config({**args, "cfg": name}) for name in config_names(args)]
+
+
+def build(project, config, forced=False):
+	try:
+		project.compile(config, forced)
+	finally:
+		import_module("Cache").global_object_cache.finish()
+
+
+def build_configurations(project, configs, forced=False):
+	"""Builds the project graph once for every configuration, scheduling all of them together"""
+	try:
+		import_module("BuildGraph").BuildGraph(project).build_configurations(configs, forced)
+	finally:
+		import_module("Cache").global_object_cache.finish()
+
+
+def link_executable(executable):
+	link_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ExecutableLink")
+	if os.path.exists(link_path):
+		os.remove(link_path)
+	os.symlink(executable, link_path)
+
+
+def compile_cmd(args):
+	project_path = os.path.abspath(args["project-path"])
+	configure_caches()
+	BuildStamp = import_module("BuildStamp")
+	names = config_names(args)
+
+	# the executable link follows the first configuration
+	executables = {}
+	outdated = []
+	for name in names:
+		stamp = timed("check build stamp", BuildStamp.is_current, project_path, name)
+		if stamp is None:
+			outdated.append(name)
+			continue
+		# nothing the last successful build depended on changed, skip loading the project graph
+		Errors.log("Build is up to date" + (f" ({name})" if len(names) > 1 else ""), 1)
+		executables[name] = stamp["executable"]
+
+	if outdated:
+		configs = get_configs({**args, "cfg": ",".join(outdated)})
+		project = load_project(args["project-path"])
+		build_configurations(project, configs)
+
+		projects = import_module("CbuildProjects").global_loaded_projects.values()
+		for config in configs:
+			executables[config.name] = project.output_file(config) if project.project_type() == "application" else None
+			timed("save build stamp", BuildStamp.save, project_path, config.name, projects, config, executables[config.name])
+
+	if executables[names[0]]:
+		link_executable(executables[names[0]])
 
 
 def recompile_cmd(args):
-	load_project(args["project-path"]).compile(get_config(args), True)
+	build_configurations(load_project(args["project-path"]), get_configs(args), True)
 
 
 def run_cmd(args):
 	project = load_project(args["project-path"])
 	cfg = get_config(args)
-	project.compile(cfg)
+	build(project, cfg)
 	project.run(cfg)
 
 
 def debug_cmd(args):
 	project = load_project(args["project-path"])
 	cfg = get_config(args)
-	project.compile(cfg)
+	build(project, cfg)
 	project.debug(cfg)
 
 
+def watch_cmd(args):
+	"""Keeps the project graph and build state loaded and rebuilds whenever a watched file changes"""
+	cfg = get_config(args)
+	project = load_project(args["project-path"])
+	config_file = os.path.join(os.path.dirname(os.path.abspath(args["project-path"])), args["cfg"] + ".json")
+	CbuildProjects = import_module("CbuildProjects")
+	Watch = import_module("Watch")
+	watcher = Watch.create_watcher()
+
+	try:
+		while True:
+			try:
+				build(project, cfg)
+				if args["run"] != "False" and project.project_type() == "application":
+					project.run(cfg)
+			except Errors.CBuildError as error:
+				Errors.err(f"Build failed : {error}")
+
+			projects = CbuildProjects.global_loaded_projects.values()
+			watcher.watch(Watch.watched_directories(projects), Watch.RelevantFiles(projects, [config_file]))
+			Errors.log("Watching for changes...", 0)
+			changes = watcher.wait()
+
+			project_files = {loaded.project_path for loaded in projects}
+			if changes.structure_changed or changes.files & project_files:
+				# file lists or project definitions changed, load the graph again
+				CbuildProjects.global_loaded_projects.clear()
+				try:
+					project = load_project(args["project-path"])
+				except Errors.CBuildError as error:
+					Errors.err(f"Unable to reload project : {error}")
+			if config_file in changes.files:
+				cfg = get_config(args)
+	except KeyboardInterrupt:
+		Errors.log("Stopped watching", 0)
+	finally:
+		watcher.close()
+
+
+def analyze_compile_cmd(args):
+	"""Ranks headers, templates and translation units by the time traces of the last build with the time_trace option"""
+	config = get_config(args)
+	project = load_project(args["project-path"])
+	CompileAnalysis = import_module("CompileAnalysis")
+	projects = import_module("CbuildProjects").global_loaded_projects.values()
+
+	try:
+		count = int(args["count"])
+	except ValueError:
+		raise Errors.CBuildError(f"Invalid count '{args['count']}' - must be a number")
+	ranked = CompileAnalysis.analyze(projects, config).ranked(count)
+	CompileAnalysis.report(ranked)
+
+	report_path = os.path.join(project.absolute_temp_dir(config), "compile-analysis.json")
+	os.makedirs(os.path.dirname(report_path), exist_ok=True)
+	with open(report_path, "w") as f:
+		json.dump(ranked, f, indent=2)
+	Errors.log(f"Report written to {report_path}", 0)
+
+
+def pgo_cmd(args):
+	"""
+	Builds an instrumented variant of the binary, runs it with the training arguments and rebuilds the configuration
+	with the merged profile. The profile is reused until the sources drift past the threshold.
+	"""
+	# the profile is applied below, after it is brought up to date
+	config = load_config(args)
+	project = load_project(args["project-path"])
+	if project.project_type() != "application":
+		raise Errors.CBuildError("Profile guided optimization needs a binary project to train")
+	try:
+		threshold = float(args["drift"])
+	except ValueError:
+		raise Errors.CBuildError(f"Invalid drift '{args['drift']}' - must be the fraction of changed sources, like 0.2")
+
+	# runs are separated by ';', every run splits its arguments like a shell would
+	shlex = import_module("shlex")
+	runs = [shlex.split(arguments) for arguments in args["training"].split(";")]
+	ProfileGuided = import_module("ProfileGuided")
+	projects = import_module("CbuildProjects").global_loaded_projects.values()
+	profile = import_module("BuildStamp").profile_file(os.path.abspath(args["project-path"]), args["cfg"])
+
+	if ProfileGuided.needs_training(profile, projects, runs, threshold):
+		instrumented = ProfileGuided.instrumented_config(project, config)
+		build(project, instrumented)
+		ProfileGuided.train(project, instrumented, runs)
+		ProfileGuided.merge(project, instrumented, profile, projects, runs)
+
+	config.profile_use = profile
+	build(project, config)
+	link_executable(project.output_file(config))
+	if config.use_profile != "True":
+		Errors.warn(f"Other commands build '{args['cfg']}' without the profile unless its use_profile option is True")
+
+
+def generate_cmd(args):
+	"""Writes the project graph as build files of another build system"""
+	generators = {"ninja": "NinjaGenerator"}
+	if args["generator"] not in generators:
+		raise Errors.CBuildError(f"Unknown generator '{args['generator']}' - available : {', '.join(generators)}")
+
+	config = get_config(args)
+	project = load_project(args["project-path"])
+	for path in import_module(generators[args["generator"]]).generate(project, config, args["cfg"]):
+		Errors.log(f"Generated {path}", 0)
+
+
 def clear_cmd(args):
 	load_project(args["project-path"]).clear(get_config(args))
 
 
 def make_cfg_cmd(args):
-	cfg = BuildConfiguration.CompilationProperties()
+	cfg = import_module("BuildConfiguration").CompilationProperties()
 	cfg.read()
 	name = input("Configuration name:")
 	cfg.save(os.path.dirname(args["project-path"]), name)
@@ -131,8 +328,14 @@ def set_cfg_cmd(args):
 		project_path += ".py"
 	project_path = os.path.abspath(project_path)
 
+	context = {}
+	if os.path.exists(file_path):
+		with open(file_path) as file:
+			context = json.load(file)
+	context.update({"config": args["cfg"], "project": project_path})
+
 	with open(file_path, 'w') as file:
-		json.dump({"config": args["cfg"], "project": project_path}, file)
+		json.dump(context, file)
 
 
 commands = {}
@@ -145,17 +348,22 @@ def initialize_context():
 	with open(default_config_file) as f:
 		config = json.load(f)
 
+	global_context.update(config)
 	default_config_name = config["config"]
 	default_project_path = config["project"]
 
 	commands = {
 		"init": {"exec": init_cmd, "args": {"directory": None, "name": None, "type": None, "add-files": "False"}},
 		"configure": {"exec": make_cfg_cmd, "args": {"project-path": default_project_path}},
-		"compile": {"exec": compile_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}},
+		"compile": {"exec": compile_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}, "options": ["jobs"]},
 		"clear": {"exec": clear_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}},
-		"recompile": {"exec": recompile_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}},
-		"run": {"exec": run_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}},
-		"debug": {"exec": debug_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}},
+		"recompile": {"exec": recompile_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}, "options": ["jobs"]},
+		"run": {"exec": run_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}, "options": ["jobs"]},
+		"debug": {"exec": debug_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name}, "options": ["jobs"]},
+		"watch": {"exec": watch_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name, "run": "False"}, "options": ["jobs"]},
+		"generate": {"exec": generate_cmd, "args": {"generator": None, "project-path": default_project_path, "cfg": default_config_name}},
+		"pgo": {"exec": pgo_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name, "training": "", "drift": "0.2"}, "options": ["jobs"]},
+		"analyze-compile": {"exec": analyze_compile_cmd, "args": {"project-path": default_project_path, "cfg": default_config_name, "count": "10"}},
 		"set-default-config": {"exec": set_cfg_cmd, "args": {"project-path": None, "cfg": None}},
 	}
 
@@ -168,9 +376,17 @@ command_macros = {
 	"recompile": ["rebuild", "rb", "rc"],
 	"run": ["r"],
 	"debug": ["dbg", "deb"],
+	"watch": ["w"],
+	"generate": ["gen"],
+	"pgo": ["profile"],
+	"analyze-compile": ["analyze", "ac"],
 	"set-default-config": ["set"]
 }
 
+command_options = {
+	"jobs": {"flags": ["-j", "--jobs"], "default": os.cpu_count() or 1, "apply": lambda jobs: import_module("Jobs").set_jobs(jobs)},
+}
+
 
 def command_descr(cmd_name, cmd) -> str:
 	args = cmd['args']
@@ -181,6 +397,9 @@ def command_descr(cmd_name, cmd) -> str:
 			out += f"\t{arg_name} : {default_val}\n"
 	else:
 		out += "\tNo arguments\n"
+	for option_name in cmd.get("options", []):
+		option = command_options[option_name]
+		out += f"\t{' '.join(option['flags'])} <{option_name}> : {option['default']}, given before the arguments\n"
 	return out
 
 
@@ -188,6 +407,9 @@ def commands_descr() -> str:
 	out = "Commands:\n"
 	for cmd_name, cmd in commands.items():
 		out += command_descr(cmd_name, cmd)
+	out += "Global options:\n\t--timings : show where startup and command time goes\n"
+	out += "\t--trace <file> : write every build step to a chrome trace file and summarize the slowest ones\n"
+	out += "Configurations of compile and recompile can be listed separated by ',', like Debug,Release, to build them together\n"
 	return out
 
 
@@ -206,8 +428,9 @@ def parse_command(cmd_args):
 		if not (command in commands):
 			raise Errors.CBuildError(f"\nCant resolve command.\n {commands_descr()}")
 
+	args_passed, options = parse_options(cmd_args[1:], commands[command].get("options", []))
+
 	args = {}
-	args_passed = [arg for arg in cmd_args[1:]]
 	for arg_name, arg_val in commands[command]["args"].items():
 		if not(arg_val is None):
 			if not len(args_passed):
@@ -223,7 +446,34 @@ def parse_command(cmd_args):
 	if len(args_passed):
 		raise Errors.CBuildError(f"\nToo many arguments given:\n for command: {command_descr(command, commands[command])}")
 
-	return {"command": command, "args": args}
+	return {"command": command, "args": args, "options": options}
+
+
+def parse_options(cmd_args, option_names) -> (list, dict):
+	"""
+	Splits the options given before the arguments of the command from the arguments.
+	Everything from the first argument on is passed to the command as is, training arguments may look like options.
+	"""
+	options = {}
+	cmd_args = list(cmd_args)
+	while len(cmd_args):
+		arg = cmd_args[0]
+		for option_name in option_names:
+			flags = command_options[option_name]["flags"]
+			if arg in flags:
+				if len(cmd_args) < 2:
+					raise Errors.CBuildError(f"\nMissing value for option '{arg}'")
+				options[option_name] = cmd_args[1]
+				del cmd_args[:2]
+				break
+			short_flag = flags[0]
+			if arg.startswith(short_flag) and arg[len(short_flag):].isdigit():
+				options[option_name] = arg[len(short_flag):]
+				del cmd_args[:1]
+				break
+		else:
+			break
+	return cmd_args, options
 
 
 def run():
@@ -233,14 +483,77 @@ def run():
 	# sys.argv += "example/App debug cfg:Debug-Intel-64".split()
 	# sys.argv += ". configure".split()
 
+	global global_timings
+	cmd_args = sys.argv[1:]
+	if "--timings" in cmd_args:
+		cmd_args.remove("--timings")
+		global_timings = []
+
+	trace_path = None
 	try:
+		if "--trace" in cmd_args:
+			index = cmd_args.index("--trace")
+			if index + 1 >= len(cmd_args):
+				raise Errors.CBuildError("\nMissing value for option '--trace'")
+			trace_path = os.path.abspath(cmd_args[index + 1])
+			del cmd_args[index:index + 2]
+			Trace.enable()
+
 		# parse and execute command
-		command = parse_command(sys.argv[1:])
-		commands[command["command"]]["exec"](command["args"]) if command else None
+		command = timed("parse command", parse_command, cmd_args)
+		for option_name, option_value in command["options"].items():
+			command_options[option_name]["apply"](option_value)
+		timed(f"command '{command['command']}'", commands[command["command"]]["exec"], command["args"]) if command else None
+		return True
 
-	except (Errors.CBuildError, Toolchain.ToolchainError) as error:
+	except Errors.CBuildError as error:
 		Errors.err(f"Unsuccessful run : {error}")
+		return False
+
+	finally:
+		if global_timings is not None:
+			report_timings()
+		if trace_path:
+			Trace.report_summary()
+			Trace.save(trace_path)
+			Errors.log(f"Trace written to {trace_path}", 0)
+
+
+def process_age():
+	"""Seconds since the process started, None where /proc is not available"""
+	try:
+		with open("/proc/self/stat") as f:
+			start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+		with open("/proc/uptime") as f:
+			uptime = float(f.read().split()[0])
+		return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+	except (OSError, ValueError, IndexError, AttributeError):
+		return None
+
+
+def report_timings():
+	phases = list(global_timings)
+	if entry_age is not None:
+		phases.insert(0, ("interpreter startup", entry_age))
+	tool_paths = sys.modules.get("ToolPathsConfig")
+	if tool_paths and tool_paths.resolution_time is not None:
+		source = "cached" if tool_paths.resolved_from_cache else "resolved"
+		phases.append((f"tool resolution ({source})", tool_paths.resolution_time))
+
+	Errors.log("Timings (nested phases are included in the enclosing ones):", 0)
+	for phase, seconds in phases:
+		Errors.log(f"\t{phase:<40} {seconds * 1000:8.1f} ms", 0)
+	Errors.log(f"\t{'total':<40} {(time.perf_counter() - entry_time + (entry_age or 0)) * 1000:8.1f} ms", 0)
+
+
+entry_time = time.perf_counter()
+entry_age = process_age() if "--timings" in sys.argv else None
+
+
+def main():
+	timed("initialize context", initialize_context)
+	sys.exit(0 if run() else 1)
 
 
-initialize_context()
-run()
+if __name__ == "__main__":
+	main()